@@ -0,0 +1,269 @@
+import time
+
+import numpy as np
+
+from bearoff import BearOffDatabase, rolls
+from bearoff import rollProbabilities as _rollProbabilities
+from cache import CachedBackgammonRules, LRUCache
+from main import BackgammonRules, blackPlayer, whitePlayer
+
+# Bounds of the equity of a position
+minEquity = -1.0
+maxEquity = 1.0
+
+# Probabilities of the 21 distinct rolls as floats, faster than numpy scalars in the search
+rollProbabilities = _rollProbabilities.tolist()
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the time budget is spent"""
+
+
+def evaluate(positions, player: int, bearOff: BearOffDatabase = None) -> float:
+    """Static evaluation of the positions for the player about to roll
+
+    Parameters
+    ----------
+    positions : sequence
+        The 26 board positions
+    player : int
+        Player on roll. Either blackPlayer or whitePlayer
+    bearOff : BearOffDatabase
+        Bear-off table used when both players have all their pieces home, if any
+
+    Returns
+    -------
+    float
+        Equity between minEquity and maxEquity, from the point of view of player
+    """
+    blackPips = whitePips = 0
+    blackBlots = whiteBlots = 0
+    blackPoints = whitePoints = 0
+    blackRear, whiteRear = 26, -1
+    for i, value in enumerate(positions):
+        if value < 0:
+            blackPips -= value * (25 - i)
+            blackBlots += value == -1 and 0 < i < 25
+            blackPoints += value <= -2 and 0 < i < 25
+            blackRear = min(blackRear, i)
+        elif value > 0:
+            whitePips += value * i
+            whiteBlots += value == 1 and 0 < i < 25
+            whitePoints += value >= 2 and 0 < i < 25
+            whiteRear = max(whiteRear, i)
+    # The player moved all its pieces out
+    if blackPips == 0 or whitePips == 0:
+        winner = blackPlayer if blackPips == 0 else whitePlayer
+        return maxEquity if winner == player else minEquity
+    if player == blackPlayer:
+        pips, opponentPips = blackPips, whitePips
+    else:
+        pips, opponentPips = whitePips, blackPips
+    # Race, the player on roll is worth about 4 pips
+    if blackRear > whiteRear:
+        if bearOff is not None and blackRear >= 19 and whiteRear <= 6:
+            rollsLeft = bearOff.expectedRolls(positions, player)
+            opponentRollsLeft = bearOff.expectedRolls(positions, -player)
+            return float(np.tanh(0.8 * (opponentRollsLeft - rollsLeft + 0.5)))
+        return float(np.tanh((opponentPips - pips + 4) / (0.1 * (pips + opponentPips) + 5)))
+    # Contact, blots are exposed and points block the opponent
+    blotsDifference = (whiteBlots - blackBlots) * -player
+    pointsDifference = (blackPoints - whitePoints) * -player
+    score = (opponentPips - pips + 4) / 40 + 0.08 * blotsDifference + 0.06 * pointsDifference
+    return float(np.tanh(score))
+
+
+def greedyPolicy(board, player: int, diceRolls: np.ndarray, legalPlays: list, rng: np.random.Generator) -> np.ndarray:
+    """Chooses the legal play with the best static evaluation, a cheap policy for rollouts"""
+    if len(legalPlays) == 1:
+        return legalPlays[0]
+    rules = BackgammonRules()
+    positions = [int(value) for value in board.positions]
+    bestValue, bestPlay = None, None
+    for legalPlay in legalPlays:
+        childPositions = rules.positionsAfterPlay(positions, player, legalPlay)
+        value = -evaluate(childPositions, -player)
+        if bestValue is None or value > bestValue:
+            bestValue, bestPlay = value, legalPlay
+    return bestPlay
+
+
+class ExpectiminimaxPlayer():
+    """Computer player searching the tree of plays and rolls with expectiminimax
+
+    Chance nodes average over the 21 distinct rolls and are pruned with Star1 and Star2 using the
+    bounds of the equity. The search deepens iteratively until the time budget is spent, the play
+    of the deepest completed search is chosen. Plays are ordered by their static evaluation.
+    """
+
+    def __init__(self, timeBudget: float = 1.0, maxDepth: int = 8, rules: BackgammonRules = None,
+                 bearOff: BearOffDatabase = None, cacheSize: int = 10000) -> None:
+        """
+        Parameters
+        ----------
+        timeBudget : float
+            Seconds allowed per decision
+        maxDepth : int
+            Maximum number of plays searched, 1 only evaluates the plays of the player on roll
+        rules : BackgammonRules
+            Rules generating the plays. A CachedBackgammonRules if None
+        bearOff : BearOffDatabase
+            Bear-off table used by the evaluation, if any
+        cacheSize : int
+            Number of ordered children kept between searches
+        """
+        self.timeBudget = timeBudget
+        self.maxDepth = maxDepth
+        self.rules = rules if rules is not None else CachedBackgammonRules()
+        self.bearOff = bearOff
+        self.childrenCache = LRUCache(cacheSize)
+        self.nodes = 0
+        self.stats = {}
+
+    def __call__(self, board, player: int, diceRolls: np.ndarray, legalPlays: list, rng: np.random.Generator) -> np.ndarray:
+        """Policy interface, see simulator.playGame"""
+        return self.choosePlay(board.positions, player, diceRolls, legalPlays)
+
+    def choosePlay(self, positions: np.ndarray, player: int, diceRolls: np.ndarray, legalPlays: list = None) -> np.ndarray:
+        """Searches the best play for the player with the given dice
+
+        Parameters
+        ----------
+        positions : ndarray
+            Array of shape (26,) containing the board positions
+        player : int
+            Player that makes the moves. Either blackPlayer or whitePlayer
+        diceRolls : ndarray
+            Array of shape (2,) containing the dice rolls
+        legalPlays : list
+            The legal plays, as returned by BackgammonRules.generateLegalPlays. Generated if None
+
+        Returns
+        -------
+        ndarray
+            One of the legal plays, array of shape (m,2)
+        """
+        start = time.perf_counter()
+        self.deadline = start + self.timeBudget
+        self.nodes = 0
+        positions = [int(value) for value in positions]
+        if legalPlays is None:
+            legalPlays = self.rules.generateLegalPlays(positions, player, diceRolls)
+        # Final positions of every play
+        children = []
+        for legalPlay in legalPlays:
+            childPositions = self.rules.positionsAfterPlay(positions, player, legalPlay)
+            children.append((tuple(childPositions), legalPlay))
+        # Order by static evaluation, the first depth
+        values = [-evaluate(childPositions, -player, self.bearOff) for childPositions, _ in children]
+        order = sorted(range(len(children)), key=lambda i: -values[i])
+        bestValue, bestPlay, depth = values[order[0]], children[order[0]][1], 1
+        if len(children) > 1:
+            for searchDepth in range(2, self.maxDepth + 1):
+                try:
+                    depthValues = self._searchRoot(children, order, player, searchDepth)
+                except SearchTimeout:
+                    break
+                # Order the next search by the values found
+                values = depthValues
+                order = sorted(range(len(children)), key=lambda i: -values[i])
+                bestValue, bestPlay, depth = values[order[0]], children[order[0]][1], searchDepth
+        elapsed = time.perf_counter() - start
+        self.stats = {"depth": depth, "nodes": self.nodes, "elapsed": elapsed,
+                      "nodesPerSecond": self.nodes / elapsed if elapsed > 0 else 0.0, "value": float(bestValue)}
+        return bestPlay
+
+    def _searchRoot(self, children: list, order: list, player: int, depth: int) -> list:
+        """Values of the root children searched to depth, plays whose value can't beat the best get an upper bound"""
+        values = [minEquity] * len(children)
+        alpha = minEquity
+        for i in order:
+            childPositions = children[i][0]
+            if self._isOver(childPositions, player):
+                values[i] = maxEquity
+            else:
+                values[i] = -self._chance(childPositions, -player, depth - 1, -maxEquity, -alpha)
+            alpha = max(alpha, values[i])
+        return values
+
+    def _isOver(self, positions, player: int) -> bool:
+        """True if the player has no pieces left on the board"""
+        return not any(value * player > 0 for value in positions)
+
+    def _orderedChildren(self, positions: tuple, player: int, roll: tuple) -> list:
+        """Distinct positions after the plays of the roll, with their static value for player, best first"""
+        key = (positions, player, roll)
+        children = self.childrenCache.get(key)
+        if children is None:
+            if time.perf_counter() > self.deadline:
+                raise SearchTimeout()
+            finals = self.rules.legalFinalPositions(positions, player, roll)
+            children = [(finalPositions,
+                         maxEquity if self._isOver(finalPositions, player) else -evaluate(finalPositions, -player, self.bearOff))
+                        for finalPositions in finals]
+            children.sort(key=lambda child: -child[1])
+            self.childrenCache.put(key, children)
+        return children
+
+    def _chance(self, positions: tuple, player: int, depth: int, alpha: float, beta: float) -> float:
+        """Expected value for the player about to roll, searching depth plays
+
+        Star1 cuts off once the values found and the bounds of the rolls left are outside (alpha, beta).
+        Star2 first probes every roll with its best ordered play, a lower bound of the roll value.
+        """
+        self.nodes += 1
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        if depth == 0:
+            return evaluate(positions, player, self.bearOff)
+        # Star2 probing, lower bounds of every roll
+        lowerBounds = [minEquity] * len(rolls)
+        exactProbes = [False] * len(rolls)
+        lowerSum = minEquity
+        for i, (roll, probability) in enumerate(zip(rolls, rollProbabilities)):
+            childPositions, staticValue = self._orderedChildren(positions, player, roll)[0]
+            probeBeta = min(maxEquity, (beta - lowerSum) / probability + minEquity)
+            lowerBounds[i] = self._childValue(childPositions, staticValue, player, depth, minEquity, probeBeta)
+            # Below probeBeta the value of the probed play is exact and doesn't need to be searched again
+            exactProbes[i] = lowerBounds[i] < probeBeta
+            lowerSum += probability * (lowerBounds[i] - minEquity)
+            if lowerSum >= beta:
+                return lowerSum
+        # Star1 search, lowerSum and upperSum bound the expected value
+        upperSum = maxEquity
+        for i, (roll, probability) in enumerate(zip(rolls, rollProbabilities)):
+            childAlpha = max(minEquity, (alpha - upperSum) / probability + maxEquity)
+            childBeta = min(maxEquity, (beta - lowerSum) / probability + lowerBounds[i])
+            value = self._max(positions, player, roll, depth, childAlpha, childBeta, lowerBounds[i], exactProbes[i])
+            upperSum += probability * (value - maxEquity)
+            lowerSum += probability * (value - lowerBounds[i])
+            if upperSum <= alpha:
+                return upperSum
+            if lowerSum >= beta:
+                return lowerSum
+        return lowerSum
+
+    def _max(self, positions: tuple, player: int, roll: tuple, depth: int, alpha: float, beta: float,
+             lowerBound: float = minEquity, skipFirst: bool = False) -> float:
+        """Value of the best play of the player with the roll, searching depth plays
+
+        lowerBound is a known lower bound of the value, the exact value of the first play if skipFirst
+        """
+        self.nodes += 1
+        best = lowerBound
+        children = self._orderedChildren(positions, player, roll)
+        for childPositions, staticValue in children[1:] if skipFirst else children:
+            value = self._childValue(childPositions, staticValue, player, depth, max(alpha, best), beta)
+            best = max(best, value)
+            if best >= beta:
+                break
+        return best
+
+    def _childValue(self, childPositions: tuple, staticValue: float, player: int, depth: int, alpha: float, beta: float) -> float:
+        """Value for the player of the positions after its play, staticValue if it is the last play searched"""
+        if depth == 1:
+            self.nodes += 1
+            return staticValue
+        if staticValue == maxEquity and self._isOver(childPositions, player):
+            return maxEquity
+        return -self._chance(childPositions, -player, depth - 1, -beta, -alpha)
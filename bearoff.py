@@ -0,0 +1,253 @@
+import itertools
+import os
+from math import comb
+
+import numpy as np
+
+from main import blackPlayer
+
+# One-sided bear-off database
+# ---------------------------
+# Every distribution of up to 15 pieces over the 6 home points of a player, indexed by distance to the end
+# (1 to 6). For each one the table stores the expected number of rolls to bear off all the pieces, playing to
+# minimize it, and the probability of bearing off in exactly k rolls, k = 0 to maxRolls - 1 (the last one
+# also counts longer bear-offs), as uint16 fractions of 65535.
+#
+# Moves follow BackgammonRules: at most 5 pieces per point, bearing off with a larger die only from the
+# furthest piece, as many dice as possible and the larger die if only one can be used. The opponent is
+# ignored, so the rule blocking bear-offs when the opponent has 2 or more pieces on its bar doesn't apply.
+
+nPoints = 6
+maxPieces = 15
+maxPerPoint = 5
+maxRolls = 32
+nPositions = comb(maxPieces + nPoints, nPoints)
+
+tableDtype = np.dtype([("expectedRolls", "<f4"), ("distribution", "<u2", (maxRolls,))])
+
+defaultPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bearoff.npy")
+
+# The 21 distinct rolls and their probabilities
+rolls = [(die0, die1) for die0 in range(1, 7) for die1 in range(1, die0 + 1)]
+rollProbabilities = np.array([1 / 36 if die0 == die1 else 2 / 36 for die0, die1 in rolls])
+
+# combinations[z, j] is comb(z, j + 1), used to index the positions
+_combinations = np.array([[comb(z, j + 1) for j in range(nPoints)] for z in range(maxPieces + nPoints)], dtype=np.int64)
+
+
+def positionIndex(counts) -> int:
+    """Index of the given distribution in the table
+
+    The distribution is written as c1 ones, a zero, c2 ones, a zero, ..., c6 ones, a zero and the remaining
+    pieces as ones. The positions of the 6 zeros among the 21 digits are ranked in the combinatorial number system.
+
+    Parameters
+    ----------
+    counts : sequence
+        Number of pieces at distance 1 to 6 of the end
+
+    Returns
+    -------
+    int
+        Index between 0 (no pieces) and nPositions - 1
+    """
+    index = 0
+    zero = -1
+    for j in range(nPoints):
+        zero += int(counts[j]) + 1
+        index += comb(zero, j + 1)
+    return index
+
+
+def positionIndices(counts: np.ndarray) -> np.ndarray:
+    """Vectorized positionIndex for an array of distributions of shape (N,6)"""
+    zeros = np.cumsum(np.asarray(counts, dtype=np.int64) + 1, axis=-1) - 1
+    return _combinations[zeros, np.arange(nPoints)].sum(axis=-1)
+
+
+def homeCounts(positions: np.ndarray, player: int) -> np.ndarray:
+    """Pieces of the player at distance 1 to 6 of the end, as checkSingleMove sees them
+
+    Black bears off from points 24 (distance 1) to 19 (distance 6) and white from points 1 to 6.
+
+    Parameters
+    ----------
+    positions : ndarray
+        Array of shape (26,) containing the board positions
+    player : int
+        Either blackPlayer or whitePlayer
+
+    Returns
+    -------
+    ndarray
+        Array of shape (6,)
+    """
+    positions = np.asarray(positions)
+    if player == blackPlayer:
+        return np.maximum(-positions[24:18:-1], 0)
+    return np.maximum(positions[1:7], 0)
+
+
+def isBearOff(positions: np.ndarray, player: int) -> bool:
+    """True if all the pieces of the player left on the board are in its home"""
+    positions = np.asarray(positions)
+    if player == blackPlayer:
+        return not np.any(positions[:19] < 0)
+    return not np.any(positions[7:] > 0)
+
+
+def _allPositions() -> np.ndarray:
+    """All the distributions, array of shape (nPositions,6) ordered by index"""
+    counts = np.zeros((nPositions, nPoints), dtype=np.int8)
+    for zeros in itertools.combinations(range(maxPieces + nPoints), nPoints):
+        distribution = np.diff(np.array((-1,) + zeros)) - 1
+        counts[positionIndex(distribution)] = distribution
+    return counts
+
+
+def _singleDieSuccessors(counts: np.ndarray) -> list:
+    """successors[index][die - 1] is the list of indices reachable with a single die"""
+    successors = []
+    for distribution in counts.tolist():
+        furthest = max((point for point in range(nPoints) if distribution[point]), default=-1)
+        byDie = []
+        for die in range(1, 7):
+            reachable = set()
+            for point in range(furthest + 1):
+                if not distribution[point]:
+                    continue
+                target = point - die
+                # Bearing off exactly, or with a larger die from the furthest piece
+                if target == -1 or (target < -1 and point == furthest):
+                    reachable.add(_moved(distribution, point, None))
+                elif target >= 0 and distribution[target] < maxPerPoint:
+                    reachable.add(_moved(distribution, point, target))
+            byDie.append(list(reachable))
+        successors.append(byDie)
+    return successors
+
+
+def _moved(distribution: list, moveFrom: int, moveTo) -> int:
+    """Index of the distribution after moving a piece, moveTo is None when bearing it off"""
+    moved = list(distribution)
+    moved[moveFrom] -= 1
+    if moveTo is not None:
+        moved[moveTo] += 1
+    return positionIndex(moved)
+
+
+def _rollSuccessors(index: int, successors: list, die0: int, die1: int) -> list:
+    """Indices reachable with a roll using as many dice as possible, [index] if nothing can be moved"""
+    if die0 == die1:
+        level = {index}
+        reached = []
+        for _ in range(4):
+            level = {nextIndex for current in level for nextIndex in successors[current][die0 - 1]}
+            # Bearing off all the pieces ends the game even if dice are left
+            if 0 in level:
+                return [0]
+            if not level:
+                break
+            reached = level
+        return list(reached) if reached else [index]
+    # Both dice, in any order
+    both = {last for first in successors[index][die0 - 1] for last in successors[first][die1 - 1]}
+    both.update(last for first in successors[index][die1 - 1] for last in successors[first][die0 - 1])
+    if both:
+        return list(both)
+    # A single die, the larger one if possible
+    for die in (max(die0, die1), min(die0, die1)):
+        if successors[index][die - 1]:
+            return successors[index][die - 1]
+    return [index]
+
+
+def generateBearOffTable() -> np.ndarray:
+    """Solves the bear-off of every distribution
+
+    The positions are solved by increasing pip count, every move lowers it.
+
+    Returns
+    -------
+    ndarray
+        Structured array of shape (nPositions,) and dtype tableDtype
+    """
+    counts = _allPositions()
+    successors = _singleDieSuccessors(counts)
+    pips = counts.astype(int) @ np.arange(1, nPoints + 1)
+    expectedRolls = np.zeros(nPositions)
+    distributions = np.zeros((nPositions, maxRolls))
+    distributions[0, 0] = 1.0
+    for index in np.argsort(pips, kind="stable").tolist():
+        if index == 0:
+            continue
+        expected = 1.0
+        stuckProbability = 0.0
+        distribution = np.zeros(maxRolls)
+        for (die0, die1), probability in zip(rolls, rollProbabilities):
+            reachable = _rollSuccessors(index, successors, die0, die1)
+            if reachable == [index]:
+                stuckProbability += probability
+                continue
+            best = min(reachable, key=expectedRolls.__getitem__)
+            expected += probability * expectedRolls[best]
+            distribution[1:] += probability * distributions[best, :-1]
+            distribution[-1] += probability * distributions[best, -1]
+        # Rolls that can't be played leave the position as it is
+        expectedRolls[index] = expected / (1 - stuckProbability)
+        for rollsNeeded in range(1, maxRolls):
+            distribution[rollsNeeded] += stuckProbability * distribution[rollsNeeded - 1]
+        distributions[index] = distribution / distribution.sum()
+    table = np.zeros(nPositions, dtype=tableDtype)
+    table["expectedRolls"] = expectedRolls
+    table["distribution"] = np.rint(distributions * 65535)
+    return table
+
+
+def writeBearOffTable(path: str = defaultPath) -> str:
+    """Generates the table and saves it to path, returns the path"""
+    np.save(path, generateBearOffTable())
+    return path
+
+
+class BearOffDatabase():
+    """Memory-mapped one-sided bear-off table"""
+
+    def __init__(self, path: str = defaultPath, generate: bool = True) -> None:
+        """
+        Parameters
+        ----------
+        path : str
+            The table file, written by writeBearOffTable
+        generate : bool
+            Generate and save the table if the file doesn't exist
+        """
+        if not os.path.exists(path):
+            if not generate:
+                raise FileNotFoundError(f"Bear-off table {path} not found, generate it with python bearoff.py")
+            writeBearOffTable(path)
+        self.path = path
+        self.table = np.load(path, mmap_mode="r")
+        if self.table.dtype != tableDtype or len(self.table) != nPositions:
+            raise ValueError(f"{path} is not a bear-off table")
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+    def index(self, positions: np.ndarray, player: int) -> int:
+        """Index of the home of the player in the given board positions"""
+        return positionIndex(homeCounts(positions, player))
+
+    def expectedRolls(self, positions: np.ndarray, player: int) -> float:
+        """Expected rolls for the player to bear off, all its pieces on the board must be in its home"""
+        return float(self.table["expectedRolls"][self.index(positions, player)])
+
+    def distribution(self, positions: np.ndarray, player: int) -> np.ndarray:
+        """Probability of bearing off in exactly 0 to maxRolls - 1 rolls, array of shape (maxRolls,)"""
+        return self.table["distribution"][self.index(positions, player)] / 65535
+
+
+if __name__ == "__main__":
+    import sys
+
+    print(f"Bear-off table written to {writeBearOffTable(*sys.argv[1:2])}")
@@ -0,0 +1,35 @@
+import numpy as np
+
+from main import BackgammonBoard, blackPlayer, whitePlayer
+
+
+def _positions(pieces: dict[int, int]) -> np.ndarray:
+    """Builds an array of shape (26,) from a {position: pieces} dict"""
+    positions = np.zeros(26, dtype=int)
+    for position, value in pieces.items():
+        positions[position] = value
+    return positions
+
+
+_initial = BackgammonBoard(logging=False).initialPositions()
+
+_middlegame = _positions({1: -2, 9: -1, 12: -4, 15: -2, 17: -3, 19: -2, 20: -1,
+                          6: 4, 8: 2, 10: 1, 13: 4, 16: 1, 21: 2, 24: 1})
+
+_bearOff = _positions({19: -2, 20: -3, 21: -2, 22: -3, 23: -1, 24: -1,
+                       1: 3, 2: 2, 3: 3, 4: 2, 5: 1, 6: 1})
+
+_barEntry = _positions({0: -2, 2: -1, 12: -3, 17: -3, 19: -3, 20: -3,
+                        3: 2, 4: 2, 5: 3, 6: 3, 8: 2, 13: 3})
+
+# Curated positions: name -> (positions, blacksHome, whitesHome, player, diceRolls)
+corpus = {
+    "opening": (_initial, 0, 0, blackPlayer, np.array([3, 1])),
+    "openingDoubles": (_initial, 0, 0, whitePlayer, np.array([6, 6])),
+    "middlegame": (_middlegame, 0, 0, blackPlayer, np.array([5, 2])),
+    "middlegameDoubles": (_middlegame, 0, 0, blackPlayer, np.array([3, 3])),
+    "middlegameWhite": (_middlegame, 0, 0, whitePlayer, np.array([4, 1])),
+    "bearOff": (_bearOff, 3, 3, blackPlayer, np.array([6, 4])),
+    "bearOffDoubles": (_bearOff, 3, 3, whitePlayer, np.array([2, 2])),
+    "barEntry": (_barEntry, 0, 0, blackPlayer, np.array([2, 1])),
+}
@@ -0,0 +1,40 @@
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Root of the repository, where the modules are imported from
+rootPath = Path(__file__).resolve().parent.parent
+
+
+def timeImport(statement: str, repeats: int) -> list[float]:
+    """Times running the statement in fresh interpreters, in seconds"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", statement], cwd=rootPath, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def benchmarkStartup(modules: list[str], repeats: int = 10) -> dict[str, float]:
+    """Median startup time of a fresh interpreter importing each module, in milliseconds
+
+    The time of the bare interpreter is reported as 'python', the import cost of a module is the difference
+    """
+    results = {"python": statistics.median(timeImport("pass", repeats)) * 1e3}
+    for module in modules:
+        results[module] = statistics.median(timeImport(f"import {module}", repeats)) * 1e3
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of the backgammon modules")
+    parser.add_argument("modules", nargs="*", default=["numpy", "main", "simulator", "cache", "boardstate"])
+    parser.add_argument("--repeats", type=int, default=10, help="number of fresh interpreters per module")
+    args = parser.parse_args()
+    results = benchmarkStartup(args.modules, args.repeats)
+    for module, milliseconds in results.items():
+        print(f"{module:>12}: {milliseconds:7.1f} ms" + (f" (+{milliseconds - results['python']:.1f} ms)" if module != "python" else ""))
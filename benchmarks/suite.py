@@ -0,0 +1,194 @@
+import argparse
+import gc
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+# Root of the repository, where the modules are imported from
+rootPath = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(rootPath))
+
+from main import BackgammonBoard, BackgammonParser, BackgammonRules  # noqa: E402
+from positions import corpus  # noqa: E402
+import simulator  # noqa: E402
+
+defaultBaselinePath = Path(__file__).resolve().parent / "baseline.json"
+
+
+def currentCommit() -> str:
+    """Commit of the benchmarked tree, None outside of a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=rootPath, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _rulesBenchmarks() -> dict:
+    """Benchmarks of BackgammonRules and BackgammonBoard over the corpus: name -> operation"""
+    rules = BackgammonRules()
+    board = BackgammonBoard(logging=False)
+    benchmarks = {}
+    for name, (positions, blacksHome, whitesHome, player, diceRolls) in corpus.items():
+        # Inputs derived from the corpus, the same on every run
+        legalPlays = rules.generateLegalPlays(positions, player, diceRolls)
+        play = legalPlays[len(legalPlays) // 2]
+        reversedPlay = play[::-1].copy()
+        invalidPlay = np.array([[[1, 2], [3, 4]]])
+        moveFrom, moveTo = (int(play[0][0]), int(play[0][1])) if len(play) else (1, 2)
+
+        def applyMoves(positions=positions, blacksHome=blacksHome, whitesHome=whitesHome, player=player, play=play):
+            board.setPositions(positions)
+            board.blacksHome = blacksHome
+            board.whitesHome = whitesHome
+            board.applyMoves(player, play)
+
+        benchmarks[f"checkMoves/{name}"] = lambda positions=positions, player=player, diceRolls=diceRolls, moves=reversedPlay[None]: \
+            rules.checkMoves(positions, moves, player, diceRolls)
+        benchmarks[f"checkMovesInvalid/{name}"] = lambda positions=positions, player=player, diceRolls=diceRolls: \
+            rules.checkMoves(positions, invalidPlay, player, diceRolls)
+        benchmarks[f"generateLegalPlays/{name}"] = lambda positions=positions, player=player, diceRolls=diceRolls: \
+            rules.generateLegalPlays(positions, player, diceRolls)
+        benchmarks[f"checkSingleMove/{name}"] = lambda positions=positions, player=player, moveFrom=moveFrom, moveTo=moveTo: \
+            rules.checkSingleMove(positions, player, moveFrom, moveTo)
+        benchmarks[f"checkPossibleMoves/{name}"] = lambda positions=positions, player=player, diceRolls=diceRolls: \
+            rules.checkPossibleMoves(positions, player, diceRolls)
+        benchmarks[f"applyMoves/{name}"] = applyMoves
+    return benchmarks
+
+
+def _parserBenchmarks() -> dict:
+    """Benchmarks of BackgammonParser: name -> operation"""
+    parser = BackgammonParser()
+    origins = np.zeros(26)
+    origins[[1, 12]] = -1
+    destins = np.zeros(26)
+    destins[[4, 13]] = +1
+    return {
+        "strToArrayOfMoves/two": lambda: parser.strToArrayOfMoves("17,20;19,20"),
+        "strToArrayOfMoves/four": lambda: parser.strToArrayOfMoves("1,4;1,4;12,15;12,15"),
+        "tupleToArrayOfMoves/two": lambda: parser.tupleToArrayOfMoves((origins, destins)),
+    }
+
+
+def _gameBenchmarks(nGames: int = 3) -> dict:
+    """Benchmarks of complete headless games with fixed seeds: name -> operation playing one game"""
+    seeds = iter(range(10 ** 9))
+
+    def randomGame():
+        # Cycle through nGames fixed seeds
+        simulator.playGame((simulator.randomPolicy, simulator.randomPolicy), np.random.default_rng(next(seeds) % nGames))
+
+    return {"playGame/random": randomGame}
+
+
+def allBenchmarks() -> dict:
+    return {**_rulesBenchmarks(), **_parserBenchmarks(), **_gameBenchmarks()}
+
+
+def timeOperation(operation, minTime: float = 0.2, repeats: int = 5) -> float:
+    """Best number of operations per second out of repeats runs of at least minTime seconds"""
+    # Find the number of calls per run
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            operation()
+        elapsed = time.perf_counter() - start
+        if elapsed >= minTime:
+            break
+        calls = max(calls * 2, int(calls * minTime / max(elapsed, 1e-9)))
+    best = elapsed
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            operation()
+        best = min(best, time.perf_counter() - start)
+    return calls / best
+
+
+def measureAllocations(operation, calls: int = 20) -> tuple[float, float]:
+    """Peak bytes allocated during one call and bytes still allocated per call after calls calls
+
+    Garbage is collected before reading the retained bytes, so that only the memory still referenced counts
+    """
+    tracemalloc.start()
+    try:
+        operation()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        operation()
+        peak = tracemalloc.get_traced_memory()[1] - current
+        gc.collect()
+        current = tracemalloc.get_traced_memory()[0]
+        for _ in range(calls):
+            operation()
+        gc.collect()
+        retained = (tracemalloc.get_traced_memory()[0] - current) / calls
+    finally:
+        tracemalloc.stop()
+    return peak, retained
+
+
+def runBenchmarks(nameFilter: str = "", minTime: float = 0.2, repeats: int = 5) -> dict:
+    """Runs the benchmarks whose name contains nameFilter
+
+    Returns
+    -------
+    dict
+        name -> {"opsPerSec", "peakBytes", "retainedBytesPerOp"}
+    """
+    results = {}
+    for name, operation in allBenchmarks().items():
+        if nameFilter not in name:
+            continue
+        opsPerSec = timeOperation(operation, minTime, repeats)
+        peak, retained = measureAllocations(operation, calls=1 if name.startswith("playGame") else 20)
+        results[name] = {"opsPerSec": opsPerSec, "peakBytes": peak, "retainedBytesPerOp": retained}
+        print(f"{name:<40} {opsPerSec:>12.1f} ops/s {peak / 1024:>10.1f} KiB peak", flush=True)
+    return results
+
+
+def compareToBaseline(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Names of the benchmarks more than tolerance (fraction) slower than the baseline"""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["opsPerSec"] / baseline[name]["opsPerSec"]
+        status = "REGRESSION" if ratio < 1 - tolerance else "ok"
+        print(f"{name:<40} {ratio:>7.2f}x baseline  {status}")
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the rules, board, parser and full-game throughput")
+    parser.add_argument("--filter", default="", help="only run the benchmarks whose name contains this text")
+    parser.add_argument("--baseline", type=Path, default=defaultBaselinePath, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before reporting a regression")
+    parser.add_argument("--min-time", type=float, default=0.2, help="minimum time of each timing run in seconds")
+    parser.add_argument("--repeats", type=int, default=5, help="number of timing runs, the best one is kept")
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.filter, args.min_time, args.repeats)
+    if args.save_baseline:
+        args.baseline.write_text(json.dumps({"python": platform.python_version(),
+                                             "numpy": np.__version__,
+                                             "commit": currentCommit(),
+                                             "benchmarks": results}, indent=2) + "\n")
+        print(f"Baseline saved to {args.baseline}")
+    elif args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        print(f"Baseline captured at commit {baseline.get('commit')}")
+        baseline = baseline["benchmarks"]
+        if compareToBaseline(results, baseline, args.tolerance):
+            sys.exit(1)
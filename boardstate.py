@@ -0,0 +1,113 @@
+import numpy as np
+
+from main import BackgammonBoard, blackPlayer, whitePlayer
+
+
+class BoardState():
+    """Immutable and hashable state of a board packed in 28 bytes
+
+    Bytes 0 to 25 are the positions and bytes 26 and 27 the blacksHome and whitesHome counts, all as int8.
+    Copies are free since the state can't change, applying a move returns a new state.
+    """
+
+    __slots__ = ("_data",)
+
+    size = 28
+
+    def __init__(self, data: bytes) -> None:
+        if len(data) != self.size:
+            raise ValueError(f"BoardState needs {self.size} bytes, got {len(data)}")
+        object.__setattr__(self, "_data", bytes(data))
+
+    @classmethod
+    def fromPositions(cls, positions: np.ndarray, blacksHome: int = 0, whitesHome: int = 0) -> "BoardState":
+        """Packs the given positions (array of shape (26,)) and home counts"""
+        return cls(np.asarray(positions, dtype=np.int8).tobytes() + np.array([blacksHome, whitesHome], dtype=np.int8).tobytes())
+
+    @classmethod
+    def fromBoard(cls, board: BackgammonBoard) -> "BoardState":
+        return cls.fromPositions(board.positions, board.blacksHome, board.whitesHome)
+
+    @classmethod
+    def initial(cls) -> "BoardState":
+        return cls.fromPositions(BackgammonBoard(logging=False).initialPositions())
+
+    def toBoard(self) -> BackgammonBoard:
+        """Unpacks the state into a new BackgammonBoard"""
+        board = BackgammonBoard(logging=False)
+        board.setPositions(self.positions.astype(int))
+        board.blacksHome = self.blacksHome
+        board.whitesHome = self.whitesHome
+        return board
+
+    def toBytes(self) -> bytes:
+        return self._data
+
+    @property
+    def positions(self) -> np.ndarray:
+        """Read-only view of shape (26,) on the positions"""
+        return np.frombuffer(self._data, dtype=np.int8, count=26)
+
+    @property
+    def blacksHome(self) -> int:
+        return int.from_bytes(self._data[26:27], "little", signed=True)
+
+    @property
+    def whitesHome(self) -> int:
+        return int.from_bytes(self._data[27:28], "little", signed=True)
+
+    def withMove(self, player: int, moveFrom: int, moveTo: int) -> "BoardState":
+        """Returns the state after applying a single valid move, same as BackgammonBoard.applySingleMove
+
+        Parameters
+        ----------
+        player : int
+            The player that does the move
+        moveFrom : int
+            Position to move from
+        moveTo : int
+            Position to move to
+        """
+        data = bytearray(self._data)
+        data[moveFrom] = (data[moveFrom] - player) & 0xff
+        # Putting pieces to home
+        if player == blackPlayer and moveTo == 25:
+            data[26] += 1
+        elif player == whitePlayer and moveTo == 0:
+            data[27] += 1
+        else:
+            target = int.from_bytes(data[moveTo:moveTo + 1], "little", signed=True)
+            # Kicking out the opponent, whites go to 25 and blacks go to 0
+            if target * player < 0:
+                bar = 25 if player == blackPlayer else 0
+                data[bar] = (data[bar] - player) & 0xff
+                target = 0
+            data[moveTo] = (target + player) & 0xff
+        return BoardState(data)
+
+    def copy(self) -> "BoardState":
+        return self
+
+    def __copy__(self) -> "BoardState":
+        return self
+
+    def __deepcopy__(self, memo) -> "BoardState":
+        return self
+
+    def __reduce__(self):
+        return (BoardState, (self._data,))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BoardState is immutable")
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, BoardState):
+            return NotImplemented
+        return self._data == other._data
+
+    def __hash__(self) -> int:
+        # bytes caches its own hash
+        return hash(self._data)
+
+    def __repr__(self) -> str:
+        return f"BoardState(positions={self.positions.tolist()}, blacksHome={self.blacksHome}, whitesHome={self.whitesHome})"
@@ -0,0 +1,122 @@
+from collections import OrderedDict
+
+import numpy as np
+
+from main import BackgammonRules
+
+
+class LRUCache():
+
+    def __init__(self, maxSize: int = 10000) -> None:
+        if maxSize < 1:
+            raise ValueError(f"maxSize must be at least 1, got {maxSize}")
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        """Returns the value stored for key, marking it as the most recently used, or default if missing"""
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Stores the value for key, evicting the least recently used entry if the cache is full"""
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hitRate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "maxSize": self.maxSize,
+                "hits": self.hits, "misses": self.misses, "hitRate": self.hitRate}
+
+
+def positionKey(positions: np.ndarray, player: int, diceRolls) -> bytes:
+    """Canonical key of the given positions, player and dice rolled
+
+    The home counts are part of the key through the positions, they are 15 minus the pieces left on the board.
+    The order of the dice doesn't matter.
+
+    Parameters
+    ----------
+    positions : ndarray
+        Array of shape (26,) containing the board positions
+    player : int
+        Player that makes the moves. Either blackPlayer or whitePlayer
+    diceRolls : ndarray
+        Array of shape (n,) containing the dice rolls
+
+    Returns
+    -------
+    bytes
+        The 26 positions, the player and the sorted dice rolls as int8
+    """
+    return (np.asarray(positions, dtype=np.int8).tobytes()
+            + bytes((player & 0xff,))
+            + bytes(sorted(int(die) for die in diceRolls)))
+
+
+class CachedBackgammonRules(BackgammonRules):
+    """BackgammonRules memoizing the legal plays and the possible moves checks in LRU caches"""
+
+    def __init__(self, maxSize: int = 10000) -> None:
+        super().__init__()
+        self.legalPlaysCache = LRUCache(maxSize)
+        self.possibleMovesCache = LRUCache(maxSize)
+
+    def _cachedLegalPlays(self, positions: np.ndarray, player: int, diceRolls: np.ndarray) -> list:
+        """Get the cache entry [_walkLegalPlays result, generateLegalPlays result or None]"""
+        key = positionKey(positions, player, diceRolls)
+        entry = self.legalPlaysCache.get(key)
+        if entry is None:
+            entry = [super()._walkLegalPlays(positions, player, diceRolls), None]
+            self.legalPlaysCache.put(key, entry)
+        return entry
+
+    def _walkLegalPlays(self, positions: np.ndarray, player: int, diceRolls: np.ndarray) -> dict[tuple, tuple[list, tuple]]:
+        return self._cachedLegalPlays(positions, player, diceRolls)[0]
+
+    def generateLegalPlays(self, positions: np.ndarray, player: int, diceRolls: np.ndarray) -> list[np.ndarray]:
+        entry = self._cachedLegalPlays(positions, player, diceRolls)
+        if entry[1] is None:
+            # The plays are shared between callers, so they are made read-only
+            entry[1] = self._distinctPlays(entry[0])
+            for legalPlay in entry[1]:
+                legalPlay.setflags(write=False)
+        return list(entry[1])
+
+    def checkPossibleMoves(self, positions: np.ndarray, player: int, diceRolls: np.ndarray) -> bool:
+        key = positionKey(positions, player, diceRolls)
+        possibleMoves = self.possibleMovesCache.get(key)
+        if possibleMoves is None:
+            possibleMoves = super().checkPossibleMoves(positions, player, diceRolls)
+            self.possibleMovesCache.put(key, possibleMoves)
+        return possibleMoves
+
+    def clear(self):
+        self.legalPlaysCache.clear()
+        self.possibleMovesCache.clear()
+
+    def stats(self) -> dict:
+        return {"legalPlays": self.legalPlaysCache.stats(),
+                "possibleMoves": self.possibleMovesCache.stats()}
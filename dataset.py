@@ -0,0 +1,299 @@
+import json
+import os
+
+import numpy as np
+
+from dice import DiceSource
+from gamerecord import GameRecordReader
+from main import BackgammonGame, BackgammonRules, blackPlayer, whitePlayer
+from simulator import randomPolicy
+
+nFeatures = 198
+maxMoves = 4
+
+# Fields of every sample: name -> (dtype, shape of one sample), maxPlays is replaced by the number of legal plays kept
+fieldSpecs = {
+    "features": ("<f4", (nFeatures,)),
+    "positions": ("i1", (26,)),
+    "homes": ("i1", (2,)),
+    "player": ("i1", ()),
+    "dice": ("i1", (2,)),
+    "play": ("i1", (maxMoves, 2)),
+    "legalPlays": ("i1", ("maxPlays", maxMoves, 2)),
+    "nLegalPlays": ("<i2", ()),
+    "outcome": ("i1", ()),
+}
+
+
+def encodePositions(positions: np.ndarray, players: np.ndarray, blacksHome: np.ndarray = None,
+                    whitesHome: np.ndarray = None) -> np.ndarray:
+    """Encodes positions as TD-Gammon style features
+
+    For every point and player 4 units: at least 1, 2 and 3 pieces, and (pieces - 3) / 2 beyond 3
+    (black points 1 to 24 first, then white). Then the pieces on the bar / 2, the pieces home / 15 and
+    whose turn it is, black first.
+
+    Parameters
+    ----------
+    positions : ndarray
+        Array of shape (N,26) containing the board positions
+    players : ndarray
+        Array of shape (N,) with the player on roll of every position
+    blacksHome, whitesHome : ndarray
+        Arrays of shape (N,) with the pieces home. 15 minus the pieces on the board if None
+
+    Returns
+    -------
+    ndarray
+        Array of shape (N,198) of float32
+    """
+    positions = np.asarray(positions, dtype=np.int16).reshape(-1, 26)
+    players = np.broadcast_to(np.asarray(players), (len(positions),))
+    if blacksHome is None:
+        blacksHome = 15 + np.minimum(positions, 0).sum(axis=1)
+    if whitesHome is None:
+        whitesHome = 15 - np.maximum(positions, 0).sum(axis=1)
+    features = np.zeros((len(positions), nFeatures), dtype=np.float32)
+    for side, player in enumerate((blackPlayer, whitePlayer)):
+        counts = np.maximum(positions[:, 1:25] * player, 0)
+        units = features[:, side * 96:(side + 1) * 96].reshape(-1, 24, 4)
+        units[:, :, 0] = counts >= 1
+        units[:, :, 1] = counts >= 2
+        units[:, :, 2] = counts >= 3
+        units[:, :, 3] = np.maximum(counts - 3, 0) / 2
+    # Bar, black is kicked out to 0 and white to 25
+    features[:, 192] = np.maximum(-positions[:, 0], 0) / 2
+    features[:, 193] = np.maximum(positions[:, 25], 0) / 2
+    features[:, 194] = np.asarray(blacksHome) / 15
+    features[:, 195] = np.asarray(whitesHome) / 15
+    features[:, 196] = players == blackPlayer
+    features[:, 197] = players == whitePlayer
+    return features
+
+
+def _padPlays(legalPlays: list, maxPlays: int) -> np.ndarray:
+    """Legal plays as an array of shape (maxPlays,maxMoves,2) padded with -1"""
+    padded = np.full((maxPlays, maxMoves, 2), -1, dtype=np.int8)
+    for i, legalPlay in enumerate(legalPlays[:maxPlays]):
+        padded[i, :len(legalPlay)] = legalPlay
+    return padded
+
+
+class _GameSamples():
+    """Samples of one game, filled turn by turn and completed with the outcome"""
+
+    def __init__(self, maxPlays: int) -> None:
+        self.maxPlays = maxPlays
+        self.turns = {name: [] for name in fieldSpecs if name not in ("features", "outcome")}
+
+    def addTurn(self, board, player: int, diceRolls: np.ndarray, play: np.ndarray, legalPlays: list):
+        self.turns["positions"].append(np.array(board.positions, dtype=np.int8))
+        self.turns["homes"].append((int(board.blacksHome), int(board.whitesHome)))
+        self.turns["player"].append(player)
+        self.turns["dice"].append(np.array(diceRolls, dtype=np.int8))
+        self.turns["play"].append(_padPlays([play], 1)[0])
+        self.turns["legalPlays"].append(_padPlays(legalPlays, self.maxPlays))
+        self.turns["nLegalPlays"].append(len(legalPlays))
+
+    def arrays(self, winner: int) -> dict:
+        """The samples as arrays, the outcome is +1 (-1) if the player on roll won (lost) and 0 if unfinished"""
+        samples = {name: np.array(values, dtype=fieldSpecs[name][0]) for name, values in self.turns.items()}
+        samples["outcome"] = (samples["player"] * winner).astype(np.int8)
+        homes = samples["homes"].reshape(-1, 2)
+        samples["features"] = encodePositions(samples["positions"], samples["player"], homes[:, 0], homes[:, 1])
+        return samples
+
+
+def playGames(nGames: int, players: tuple = (randomPolicy, randomPolicy), seed: int = None, maxPlays: int = 32, maxTurns: int = 10000):
+    """Plays games and yields their samples, one dict of arrays (see fieldSpecs) per game
+
+    Parameters
+    ----------
+    nGames : int
+        Number of games to play
+    players : tuple
+        The (black, white) policies, see simulator.playGame
+    seed : int
+        Seed of the dice and the policy
+    maxPlays : int
+        Number of legal plays kept per sample, nLegalPlays has the total
+    maxTurns : int
+        Maximum number of turns of a game, the outcome of unfinished games is 0
+    """
+    policy = {blackPlayer: players[0], whitePlayer: players[1]}
+    rules = BackgammonRules()
+    policySeed, diceSeed = np.random.SeedSequence(seed).spawn(2)
+    rng = np.random.default_rng(policySeed)
+    dice = DiceSource(diceSeed)
+    for _ in range(nGames):
+        game = BackgammonGame(logging=False, dice=dice)
+        samples = _GameSamples(maxPlays)
+        winner = 0
+        for _ in range(maxTurns):
+            diceRolls = game.dice.roll()
+            legalPlays = rules.generateLegalPlays(game.board.positions, game.whoseTurn, diceRolls)
+            play = np.asarray(policy[game.whoseTurn](game.board, game.whoseTurn, diceRolls, legalPlays, rng))
+            samples.addTurn(game.board, game.whoseTurn, diceRolls, play, legalPlays)
+            winner = game.playTurn(play, diceRolls)
+            if winner != 0:
+                break
+        yield samples.arrays(winner)
+
+
+def replayGames(reader: GameRecordReader, maxPlays: int = 32):
+    """Replays recorded games and yields their samples, one dict of arrays (see fieldSpecs) per game"""
+    rules = BackgammonRules()
+    for recordedGame in reader:
+        board = recordedGame.startingBoard()
+        samples = _GameSamples(maxPlays)
+        for player, diceRolls, moves in recordedGame.turns:
+            legalPlays = rules.generateLegalPlays(board.positions, player, diceRolls)
+            samples.addTurn(board, player, diceRolls, moves, legalPlays)
+            board.applyMoves(player, moves)
+        yield samples.arrays(recordedGame.winner)
+
+
+class ShardWriter():
+    """Writes samples to fixed-size .npy shards, one file per field, and keeps an index.json
+
+    Only the shard being filled is open, as memory maps, so the memory used doesn't grow with the dataset.
+    """
+
+    def __init__(self, directory: str, shardSize: int = 1000000, maxPlays: int = None) -> None:
+        """
+        Parameters
+        ----------
+        directory : str
+            Directory of the shards and the index
+        shardSize : int
+            Samples per shard
+        maxPlays : int
+            Legal plays kept per sample, taken from the first samples written if None
+        """
+        self.directory = directory
+        self.shardSize = shardSize
+        self.maxPlays = maxPlays
+        self.fields = None
+        os.makedirs(directory, exist_ok=True)
+        self.shards = []
+        self.arrays = None
+        self.size = 0
+
+    def _openShard(self):
+        name = f"shard-{len(self.shards):05d}"
+        self.arrays = {field: np.lib.format.open_memmap(os.path.join(self.directory, f"{name}.{field}.npy"), mode="w+",
+                                                        dtype=dtype, shape=(self.shardSize,) + shape)
+                       for field, (dtype, shape) in self.fields.items()}
+        self.shards.append({"name": name, "size": 0})
+        self.size = 0
+
+    def _closeShard(self):
+        for array in self.arrays.values():
+            array.flush()
+        self.arrays = None
+        self.writeIndex()
+
+    def _setFields(self, samples: dict):
+        """Shapes of the fields, maxPlays is the one of the samples if not given"""
+        if self.maxPlays is None:
+            self.maxPlays = samples["legalPlays"].shape[1]
+        self.fields = {name: (dtype, tuple(self.maxPlays if size == "maxPlays" else size for size in shape))
+                       for name, (dtype, shape) in fieldSpecs.items()}
+
+    def write(self, samples: dict):
+        """Appends samples, a dict of arrays with the same number of rows (see fieldSpecs)"""
+        if self.fields is None:
+            self._setFields(samples)
+        for field, (_, shape) in self.fields.items():
+            if samples[field].shape[1:] != shape:
+                raise ValueError(f"Samples {field} of shape {samples[field].shape[1:]} don't match the shape {shape} "
+                                 f"of the dataset, write the samples with the same maxPlays")
+        nSamples = len(samples["player"])
+        written = 0
+        while written < nSamples:
+            if self.arrays is None:
+                self._openShard()
+            count = min(nSamples - written, self.shardSize - self.size)
+            for field, array in self.arrays.items():
+                array[self.size:self.size + count] = samples[field][written:written + count]
+            self.size += count
+            self.shards[-1]["size"] = self.size
+            written += count
+            if self.size == self.shardSize:
+                self._closeShard()
+
+    def writeIndex(self):
+        # No fields until the first samples are written
+        index = {"shardSize": self.shardSize,
+                 "fields": {field: [dtype, list(shape)] for field, (dtype, shape) in (self.fields or {}).items()},
+                 "shards": self.shards,
+                 "total": sum(shard["size"] for shard in self.shards)}
+        with open(os.path.join(self.directory, "index.json"), "w", encoding="utf-8") as file:
+            json.dump(index, file, indent=2)
+
+    def close(self):
+        if self.arrays is not None:
+            self._closeShard()
+        else:
+            self.writeIndex()
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ShardedDataset():
+    """Reader of the shards written by ShardWriter, memory-mapped"""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        with open(os.path.join(directory, "index.json"), encoding="utf-8") as file:
+            self.index = json.load(file)
+        self.sizes = np.array([shard["size"] for shard in self.index["shards"]], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.sizes)))
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def shard(self, shard: int) -> dict:
+        """The fields of a shard as read-only memory maps, trimmed to its size"""
+        name = self.index["shards"][shard]["name"]
+        return {field: np.load(os.path.join(self.directory, f"{name}.{field}.npy"), mmap_mode="r")[:self.sizes[shard]]
+                for field in self.index["fields"]}
+
+    def batches(self, batchSize: int = 4096):
+        """Yields dicts of arrays of batchSize samples (the last ones of a shard can be fewer), in order"""
+        for shard in range(len(self.sizes)):
+            arrays = self.shard(shard)
+            for start in range(0, int(self.sizes[shard]), batchSize):
+                yield {field: np.array(array[start:start + batchSize]) for field, array in arrays.items()}
+
+
+def writeDataset(directory: str, games, shardSize: int = 1000000, maxPlays: int = None) -> int:
+    """Writes the samples of games (e.g. playGames or replayGames) to shards, returns the number of samples
+
+    maxPlays is taken from the samples if None, otherwise it has to be the one of the games
+    """
+    with ShardWriter(directory, shardSize, maxPlays) as writer:
+        for samples in games:
+            writer.write(samples)
+    return ShardedDataset(directory).__len__()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Write training positions of random games to .npy shards")
+    parser.add_argument("directory", help="output directory")
+    parser.add_argument("--games", type=int, default=100, help="number of games to play")
+    parser.add_argument("--records", default=None, help="game record file to replay instead of playing games")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the games")
+    parser.add_argument("--shard-size", type=int, default=1000000, help="samples per shard")
+    parser.add_argument("--max-plays", type=int, default=32, help="legal plays kept per sample")
+    args = parser.parse_args()
+    if args.records is not None:
+        games = replayGames(GameRecordReader(args.records), args.max_plays)
+    else:
+        games = playGames(args.games, seed=args.seed, maxPlays=args.max_plays)
+    print(f"{writeDataset(args.directory, games, args.shard_size)} samples written to {args.directory}")
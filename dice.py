@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class DiceSource():
+    """Source of dice rolls generated in blocks from a numpy Generator
+
+    The rolls can be recorded and replayed exactly with DiceSource.fromRolls.
+    """
+
+    def __init__(self, seed=None, blockSize: int = 4096, record: bool = False) -> None:
+        """
+        Parameters
+        ----------
+        seed : None, int, SeedSequence or Generator
+            Seed of the rolls, passed to np.random.default_rng. A Generator is used as is
+        blockSize : int
+            Number of rolls generated at once
+        record : bool
+            Keep every roll so they can be replayed
+        """
+        self.rng = np.random.default_rng(seed)
+        self.blockSize = blockSize
+        self.block = np.empty((0, 2), dtype=np.int8)
+        self.index = 0
+        self.history = [] if record else None
+
+    @classmethod
+    def fromRolls(cls, rolls: np.ndarray, record: bool = False, seed=None) -> "DiceSource":
+        """Source replaying the given rolls (array of shape (n,2))
+
+        Once they are exhausted it raises IndexError, or continues with random rolls from seed if given
+        """
+        source = cls(seed, record=record)
+        if seed is None:
+            source.rng = None
+        source.block = np.array(rolls, dtype=np.int8).reshape(-1, 2)
+        return source
+
+    def roll(self) -> np.ndarray:
+        """Returns the next roll as an array of shape (2,)"""
+        if self.index == len(self.block):
+            self.refill()
+        rolls = self.block[self.index]
+        self.index += 1
+        if self.history is not None:
+            self.history.append(rolls)
+        return rolls
+
+    def refill(self):
+        """Generates the next block of rolls"""
+        if self.rng is None:
+            raise IndexError("All the replayed rolls have been used")
+        self.block = self.rng.integers(1, 7, (self.blockSize, 2), dtype=np.int8)
+        self.index = 0
+
+    def recordedRolls(self) -> np.ndarray:
+        """Returns the recorded rolls as an array of shape (n,2)"""
+        if self.history is None:
+            raise ValueError("The rolls of this DiceSource are not recorded")
+        return np.array(self.history, dtype=np.int8).reshape(-1, 2)
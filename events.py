@@ -0,0 +1,46 @@
+import json
+import time
+from collections import deque
+
+# Stream recording the events of the rules engine, None when disabled
+activeStream = None
+
+
+class EventStream():
+    """Ring buffer of structured events keeping only the last maxSize records"""
+
+    def __init__(self, maxSize: int = 10000) -> None:
+        self.records = deque(maxlen=maxSize)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def record(self, event: str, **fields):
+        """Appends an event, e.g. record("rejected", player=-1, moves=[[1, 4]], reason="too large")"""
+        self.records.append({"time": time.time(), "event": event, **fields})
+
+    def dump(self) -> list[dict]:
+        """Returns the recorded events, oldest first"""
+        return list(self.records)
+
+    def dumpJson(self, path: str):
+        """Writes the recorded events to path as JSON lines"""
+        with open(path, "w", encoding="utf-8") as file:
+            for record in self.records:
+                file.write(json.dumps(record) + "\n")
+
+    def clear(self):
+        self.records.clear()
+
+
+def enable(maxSize: int = 10000) -> EventStream:
+    """Starts recording events into a new stream and returns it"""
+    global activeStream
+    activeStream = EventStream(maxSize)
+    return activeStream
+
+
+def disable():
+    """Stops recording events"""
+    global activeStream
+    activeStream = None
@@ -0,0 +1,217 @@
+import io
+import os
+import struct
+
+import numpy as np
+
+from main import BackgammonBoard, blackPlayer
+
+# File layout
+# -----------
+# Header: b"BGRC", version (uint8), 3 reserved bytes
+# Game start: b"G", starting player (int8), has positions (uint8)
+#             [26 positions (int8), blacksHome (int8), whitesHome (int8)] if has positions
+# Turn:       b"T", die 0 (uint8), die 1 (uint8), player (int8), number of moves n (uint8), n x [from, to] (uint8)
+# Game end:   b"E", winner (int8, 0 if unfinished)
+#
+# The writer also appends the offset of every game start as uint64 to the index file path + ".idx"
+
+magic = b"BGRC"
+version = 1
+headerSize = 8
+
+
+class RecordedGame():
+
+    def __init__(self, startingPlayer: int, positions: np.ndarray, blacksHome: int, whitesHome: int,
+                 turns: list, winner: int) -> None:
+        self.startingPlayer = startingPlayer
+        self.positions = positions
+        self.blacksHome = blacksHome
+        self.whitesHome = whitesHome
+        # List of (player, diceRolls, moves) tuples, moves is an array of shape (n,2)
+        self.turns = turns
+        self.winner = winner
+
+    def __len__(self) -> int:
+        return len(self.turns)
+
+    def startingBoard(self) -> BackgammonBoard:
+        board = BackgammonBoard(logging=False)
+        board.setPositions(self.positions)
+        board.blacksHome = self.blacksHome
+        board.whitesHome = self.whitesHome
+        return board
+
+    def replay(self):
+        """Yields the board after every turn, the same board object is updated in place"""
+        board = self.startingBoard()
+        for player, diceRolls, moves in self.turns:
+            board.applyMoves(player, moves)
+            yield board
+
+
+class GameRecordWriter():
+    """Append-only writer of game records"""
+
+    def __init__(self, path: str = None) -> None:
+        """
+        Parameters
+        ----------
+        path : str
+            File to append the games to. If None the games are kept in memory, without file header,
+            to be appended to a file with appendGames (e.g. by the process that owns the file)
+        """
+        self.path = path
+        if path is None:
+            self.file = io.BytesIO()
+            self.indexFile = io.BytesIO()
+        else:
+            self.file = open(path, "ab")
+            self.indexFile = open(str(path) + ".idx", "ab")
+            # Write the header to new files
+            if self.file.tell() == 0:
+                self.file.write(magic + struct.pack("<B3x", version))
+        self.gameOpen = False
+
+    def startGame(self, startingPlayer: int = blackPlayer, board: BackgammonBoard = None):
+        """Starts a new game, storing the starting positions if board isn't in the initial positions"""
+        if self.gameOpen:
+            self.endGame(0)
+        # Indexed by endGame, once the game is on disk
+        self.gameStart = self.file.tell()
+        hasPositions = board is not None and (board.blacksHome != 0 or board.whitesHome != 0
+                                              or not np.array_equal(board.positions, board.initialPositions()))
+        self.file.write(b"G" + struct.pack("<bB", startingPlayer, hasPositions))
+        if hasPositions:
+            self.file.write(np.asarray(board.positions, dtype=np.int8).tobytes()
+                            + struct.pack("<bb", int(board.blacksHome), int(board.whitesHome)))
+        self.gameOpen = True
+
+    def writeTurn(self, player: int, diceRolls: np.ndarray, moves: np.ndarray):
+        """Appends a turn of the current game"""
+        moves = np.asarray(moves, dtype=np.uint8).reshape(-1, 2)
+        self.file.write(b"T" + struct.pack("<BBbB", int(diceRolls[0]), int(diceRolls[1]), player, len(moves)) + moves.tobytes())
+
+    def endGame(self, winner: int):
+        """Ends the current game and flushes it to disk, then its offset to the index"""
+        self.file.write(b"E" + struct.pack("<b", winner))
+        self.gameOpen = False
+        self.file.flush()
+        # A process dying mid-game leaves no index entry to a truncated game
+        self.indexFile.write(struct.pack("<Q", self.gameStart))
+        self.indexFile.flush()
+
+    def appendGames(self, data: bytes, offsets: np.ndarray):
+        """Appends complete games written by another writer
+
+        Parameters
+        ----------
+        data : bytes
+            The games, without file header
+        offsets : ndarray
+            Offsets of the games starts in data
+        """
+        base = self.file.tell()
+        self.file.write(data)
+        self.indexFile.write((np.asarray(offsets, dtype=np.uint64) + np.uint64(base)).astype("<u8").tobytes())
+        self.flush()
+
+    def getGames(self) -> tuple[bytes, np.ndarray]:
+        """Returns the games written to memory and their offsets, see appendGames"""
+        return self.file.getvalue(), np.frombuffer(self.indexFile.getvalue(), dtype="<u8")
+
+    def flush(self):
+        self.file.flush()
+        self.indexFile.flush()
+
+    def close(self):
+        if self.gameOpen:
+            self.endGame(0)
+        self.file.close()
+        self.indexFile.close()
+
+    def __enter__(self) -> "GameRecordWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GameRecordReader():
+    """Memory-mapped reader of game records, games are only decoded when accessed"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(self.data[:4]) != magic:
+            raise ValueError(f"{path} is not a game record file")
+        if self.data[4] != version:
+            raise ValueError(f"Unsupported game record version {self.data[4]}")
+        indexPath = str(path) + ".idx"
+        if os.path.exists(indexPath) and os.path.getsize(indexPath) > 0:
+            self.offsets = np.memmap(indexPath, dtype="<u8", mode="r")
+            # Entries of games cut off by the end of the file, written before the game was on disk
+            self.offsets = self.offsets[self.offsets < len(self.data)]
+        else:
+            self.offsets = self._scanOffsets()
+
+    def _scanOffsets(self) -> np.ndarray:
+        """Finds the games starts when the index file is missing"""
+        offsets = []
+        offset = headerSize
+        while offset < len(self.data):
+            tag = self.data[offset]
+            if tag == ord("G"):
+                offsets.append(offset)
+                offset += 3 + (28 if self.data[offset + 2] else 0)
+            elif tag == ord("T"):
+                offset += 5 + 2 * int(self.data[offset + 4])
+            elif tag == ord("E"):
+                offset += 2
+            else:
+                raise ValueError(f"Corrupted game record at byte {offset}")
+        return np.array(offsets, dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __getitem__(self, game: int) -> RecordedGame:
+        if game < 0:
+            game += len(self)
+        if not 0 <= game < len(self):
+            raise IndexError(f"Game {game} out of range")
+        return self._readGame(int(self.offsets[game]))
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield self._readGame(int(offset))
+
+    def _readGame(self, offset: int) -> RecordedGame:
+        data = self.data
+        if data[offset] != ord("G"):
+            raise ValueError(f"Corrupted game record at byte {offset}")
+        startingPlayer = int(data[offset + 1].view(np.int8))
+        if data[offset + 2]:
+            state = np.array(data[offset + 3:offset + 31]).view(np.int8)
+            positions, blacksHome, whitesHome = state[:26].astype(int), int(state[26]), int(state[27])
+            offset += 31
+        else:
+            positions, blacksHome, whitesHome = BackgammonBoard(logging=False).initialPositions(), 0, 0
+            offset += 3
+        turns = []
+        winner = 0
+        while offset < len(data):
+            tag = data[offset]
+            if tag == ord("T"):
+                nMoves = int(data[offset + 4])
+                moves = np.array(data[offset + 5:offset + 5 + 2 * nMoves], dtype=int).reshape(-1, 2)
+                turns.append((int(data[offset + 3].view(np.int8)), np.array(data[offset + 1:offset + 3], dtype=int), moves))
+                offset += 5 + 2 * nMoves
+            elif tag == ord("E"):
+                winner = int(data[offset + 1].view(np.int8))
+                break
+            else:
+                # Game without end record
+                break
+        return RecordedGame(startingPlayer, positions, blacksHome, whitesHome, turns, winner)
@@ -1,47 +1,156 @@
 import numpy as np
-from sympy.utilities.iterables import multiset_permutations
-import copy
 import logging
 
-logging.basicConfig(filename="backgammon.log",
-                    filemode="w",
-                    encoding="utf-8",
-                    level=logging.DEBUG,
-                    format="%(asctime)s: %(levelname)s: %(message)s",
-                    datefmt="%d/%m/%Y %H:%M:%S")
+import events
+from dice import DiceSource
+
+logger = logging.getLogger("backgammon")
 
 blackPlayer = -1
 whitePlayer = +1
 
+# Bit i of the legality masks is position i
+pointsMask = ((1 << 25) - 1) & ~1                   # Points 1 to 24, bars excluded
+outsideHomeMasks = {blackPlayer: (1 << 19) - 1,     # Black must have no piece in 0 to 18 to move out
+                    whitePlayer: ((1 << 26) - 1) & ~((1 << 7) - 1)}  # White in 7 to 25
+
+
+def movesKey(moves) -> tuple:
+    """Sorted (from, to) moves of a play, the same for any order of the moves. Key of BackgammonRules.legalMoveSets"""
+    return tuple(sorted(tuple(move) for move in np.asarray(moves).reshape(-1, 2).tolist()))
+
 class BackgammonGame():
     
-    def __init__(self) -> None:
-        print("Welcome to Backgammon!")
+    def __init__(self, logging: bool = True, dice: DiceSource = None, recorder=None) -> None:
+        self.enableLogging = logging
+        # Source of the dice rolls, seeded from the OS if not given
+        self.dice = dice if dice is not None else DiceSource()
+        # gamerecord.GameRecordWriter the turns are appended to, if any
+        self.recorder = recorder
         self.setStartingValues()
+    
+    def play(self):
+        print("Welcome to Backgammon!")
         input("Press enter to start playing")
         self.mainLoop()
     
     def setStartingValues(self):
-        self.board = BackgammonBoard()
+        self.board = BackgammonBoard(logging=self.enableLogging)
         self.gameFinished = False
         self.whoseTurn = blackPlayer
+        self.recording = False
+        self.winner = 0
+        # Doubling cube, centered (owner 0) until a double is taken
+        self.cubeValue = 1
+        self.cubeOwner = 0
+        self.cubeDropped = False
+    
+    def canDouble(self, player: int) -> bool:
+        """True if the player can double before rolling, it is its turn and it owns the cube or nobody does"""
+        return not self.gameFinished and player == self.whoseTurn and self.cubeOwner in (0, player)
+    
+    def double(self, player: int, taken: bool) -> int:
+        """The player doubles and the opponent takes or drops the cube
+        
+        Parameters
+        ----------
+        player : int
+            Player doubling, whose turn it is
+        taken : bool
+            True if the opponent takes the cube, which it then owns, False if it drops and loses the game
+        
+        Returns
+        -------
+        int
+            0 if the game is still on, the player if the opponent dropped
+        """
+        if not self.canDouble(player):
+            raise ValueError(f"Player {player} can't double")
+        if taken:
+            self.cubeValue *= 2
+            self.cubeOwner = -player
+            return 0
+        self.gameFinished = True
+        self.cubeDropped = True
+        self.winner = player
+        if self.enableLogging:
+            logger.info("Player %s wins, the cube was dropped", player)
+        if self.recorder is not None:
+            # The game may be dropped before its first turn
+            if not self.recording:
+                self.recorder.startGame(self.whoseTurn, self.board)
+                self.recording = True
+            self.recorder.endGame(player)
+        return player
+    
+    @property
+    def points(self) -> int:
+        """Points won by the winner of the finished game, the cube value times the game value. 0 while the game is on"""
+        if not self.gameFinished:
+            return 0
+        if self.cubeDropped:
+            return self.cubeValue
+        return self.cubeValue * self.board.gameValue(self.winner)
+    
+    def playTurn(self, moves: np.ndarray, diceRolls: np.ndarray = None) -> int:
+        """Applies the valid moves of the player whose turn it is and passes the turn
+        
+        Parameters
+        ----------
+        moves : ndarray
+            Array of shape (n,2) containign the moves. Empty if no move is possible
+        diceRolls : ndarray
+            Array of shape (2,) containing the dice rolled, needed if the game is recorded
+        
+        Returns
+        -------
+        int
+            0 if the game is still on
+            blackPlayer (whitePlayer) if the Black (White) player has won
+        """
+        # Record the turn, the game starts with its first turn
+        if self.recorder is not None:
+            if not self.recording:
+                self.recorder.startGame(self.whoseTurn, self.board)
+                self.recording = True
+            self.recorder.writeTurn(self.whoseTurn, diceRolls, moves)
+        # Apply moves to the board
+        outcome = self.board.applyMoves(self.whoseTurn, moves)
+        # Handle end of the game
+        if outcome != 0:
+            self.gameFinished = True
+            self.winner = outcome
+            if self.enableLogging:
+                logger.info("Player %s wins", outcome)
+            if self.recorder is not None:
+                self.recorder.endGame(outcome)
+        # Switch player
+        self.whoseTurn *= -1
+        return outcome
         
     def mainLoop(self):
-        logging.info("Entering mainLoop()")
+        logger.info("Entering mainLoop()")
         while self.gameFinished == False:
             # Generate the dice rolls
-            diceRolls = np.random.randint(1, 7, 2)
-            logging.debug(f"Player: {self.whoseTurn} Dice rolls: {diceRolls}")
+            diceRolls = self.dice.roll()
+            logger.debug("Player: %s Dice rolls: %s", self.whoseTurn, diceRolls)
             # Show the board
             self.board.display()
             strPlayer = "Black" if self.whoseTurn == blackPlayer else "White"
             print(f"{strPlayer} dice rolled {diceRolls[0]} and {diceRolls[1]}! \nMoves format: 'from,to;from,to;from,to;from,to'")
+            # Skip the turn if no move is possible
+            legalPlays = BackgammonRules().generateLegalPlays(self.board.positions, self.whoseTurn, diceRolls)
+            if len(legalPlays) == 1 and len(legalPlays[0]) == 0:
+                logger.debug("Player %s can't move", self.whoseTurn)
+                print(f"{strPlayer} can't move!")
+                self.playTurn(legalPlays[0], diceRolls)
+                continue
             # Get moves
             while True:
                 try:
                     # Get the next moves
                     strMoves = input(f"What are {strPlayer} moves? ")
-                    logging.debug(f"Input moves: {strMoves}")
+                    logger.debug("Input moves: %s", strMoves)
                     # Parse the moves into array format
                     arrMoves = BackgammonParser().strToArrayOfMoves(strMoves)
                     ## # Parse the array into array format (will be necessary later)
@@ -57,19 +166,13 @@ class BackgammonGame():
                 except:
                     pass
                 print("Invalid moves, try again...")
-            # Apply moves to the board
-            outcome = self.board.applyMoves(self.whoseTurn, validMoves)
+            # Apply moves to the board and switch player
+            outcome = self.playTurn(validMoves, diceRolls)
             # Handle end of the game
             if outcome == blackPlayer:
-                self.gameFinished = True
-                logging.info(f"Player {outcome} wins")
                 print("Black player wins!!!")
             elif outcome == whitePlayer:
-                self.gameFinished = True
-                logging.info(f"Player {outcome} wins")
-                print("Black player wins!!!")
-            # Switch player
-            self.whoseTurn *= -1
+                print("White player wins!!!")
 
 class BackgammonBoard():
     
@@ -78,6 +181,7 @@ class BackgammonBoard():
         self.blacksHome = 0
         self.whitesHome = 0
         self.enableLogging = logging
+        self.countPieces()
         
     def initialPositions(self):
         return np.array([0, 
@@ -91,8 +195,126 @@ class BackgammonBoard():
         return self.positions
     
     def setPositions(self, newPositions: np.ndarray):
-        # Deep copy of given positions
-        self.positions = copy.deepcopy(newPositions)
+        # Copy of given positions
+        self.positions = np.array(newPositions)
+        self.countPieces()
+    
+    def countPieces(self):
+        """Counts the pips, pieces out of home and rearmost pieces from scratch
+        
+        They are then updated incrementally by makeMove and applySingleMove. Call it after changing positions directly
+        """
+        positions = self.positions.tolist()
+        # Pips left to move all the pieces out. Black moves to 25 and white to 0
+        self.blackPips = sum(-value * (25 - i) for i, value in enumerate(positions) if value < 0)
+        self.whitePips = sum(value * i for i, value in enumerate(positions) if value > 0)
+        # Pieces out of home. Home is 19 to 24 for black and 1 to 6 for white
+        self.blacksOutside = sum(-value for value in positions[:19] if value < 0)
+        self.whitesOutside = sum(value for value in positions[7:] if value > 0)
+        # Rearmost positions of each player, 26 (-1) if black (white) has no pieces on the board
+        self.blackRear = next((i for i, value in enumerate(positions) if value < 0), 26)
+        self.whiteRear = next((i for i in range(25, -1, -1) if positions[i] > 0), -1)
+        # Bitmasks of the positions with pieces, with 2+ pieces (made points) and with 5+ pieces of each player
+        self.occupied = {blackPlayer: 0, whitePlayer: 0}
+        self.madePoints = {blackPlayer: 0, whitePlayer: 0}
+        self.fullPoints = {blackPlayer: 0, whitePlayer: 0}
+        for i, value in enumerate(positions):
+            if value != 0:
+                self._setMasks(i, value)
+    
+    def _setMasks(self, position: int, value: int):
+        """Sets the bits of the position in the masks of the player owning its value pieces"""
+        bit = 1 << position
+        player, count = (blackPlayer, -value) if value < 0 else (whitePlayer, value)
+        self.occupied[player] |= bit
+        if count >= 2:
+            self.madePoints[player] |= bit
+            if count >= 5:
+                self.fullPoints[player] |= bit
+    
+    def _updateMasks(self, position: int):
+        """Updates the bits of the position in the masks after its pieces changed"""
+        bit = 1 << position
+        value = int(self.positions[position])
+        occupied, madePoints, fullPoints = self.occupied, self.madePoints, self.fullPoints
+        occupied[blackPlayer] = (occupied[blackPlayer] | bit) if value <= -1 else (occupied[blackPlayer] & ~bit)
+        occupied[whitePlayer] = (occupied[whitePlayer] | bit) if value >= 1 else (occupied[whitePlayer] & ~bit)
+        madePoints[blackPlayer] = (madePoints[blackPlayer] | bit) if value <= -2 else (madePoints[blackPlayer] & ~bit)
+        madePoints[whitePlayer] = (madePoints[whitePlayer] | bit) if value >= 2 else (madePoints[whitePlayer] & ~bit)
+        fullPoints[blackPlayer] = (fullPoints[blackPlayer] | bit) if value <= -5 else (fullPoints[blackPlayer] & ~bit)
+        fullPoints[whitePlayer] = (fullPoints[whitePlayer] | bit) if value >= 5 else (fullPoints[whitePlayer] & ~bit)
+    
+    def masks(self, player: int) -> tuple[int, int, int]:
+        """The (occupied, full points, opponent made points) masks of the player, see BackgammonRules.singleStepsFromMasks"""
+        return self.occupied[player], self.fullPoints[player], self.madePoints[-player]
+    
+    @property
+    def blackPipCount(self) -> int:
+        return self.blackPips
+    
+    @property
+    def whitePipCount(self) -> int:
+        return self.whitePips
+    
+    def pipCount(self, player: int) -> int:
+        return self.blackPips if player == blackPlayer else self.whitePips
+    
+    def piecesOutsideHome(self, player: int) -> int:
+        return self.blacksOutside if player == blackPlayer else self.whitesOutside
+    
+    def allHome(self, player: int) -> bool:
+        """True if the player can move pieces out, all its pieces on the board are in its home"""
+        return self.piecesOutsideHome(player) == 0
+    
+    @property
+    def hasContact(self) -> bool:
+        """True while a black piece still has to pass a white piece"""
+        return self.blackRear < self.whiteRear
+    
+    @property
+    def isRace(self) -> bool:
+        return not self.hasContact
+
+    def gameValue(self, winner: int) -> int:
+        """Points won by the winner of the finished game, before the cube
+
+        3 for a backgammon (the loser has no piece home and a piece on the bar or in the winner's home),
+        2 for a gammon (the loser has no piece home) and 1 otherwise
+        """
+        if winner == blackPlayer:
+            loserHome, backgammon = self.whitesHome, self.whiteRear >= 19
+        else:
+            loserHome, backgammon = self.blacksHome, self.blackRear <= 6
+        if loserHome > 0:
+            return 1
+        return 3 if backgammon else 2
+
+    def _addPieces(self, player: int, position: int, count: int):
+        """Updates the counts after putting count pieces of the player on position"""
+        self._updateMasks(position)
+        if player == blackPlayer:
+            self.blackPips += count * (25 - position)
+            self.blacksOutside += count * (position < 19)
+            self.blackRear = min(self.blackRear, position)
+        else:
+            self.whitePips += count * position
+            self.whitesOutside += count * (position > 6)
+            self.whiteRear = max(self.whiteRear, position)
+    
+    def _removePieces(self, player: int, position: int, count: int):
+        """Updates the counts after taking count pieces of the player from position"""
+        self._updateMasks(position)
+        if player == blackPlayer:
+            self.blackPips -= count * (25 - position)
+            self.blacksOutside -= count * (position < 19)
+            # Find the next rearmost piece if the last one left
+            if position == self.blackRear and self.positions[position] >= 0:
+                self.blackRear = next((i for i in range(position + 1, 26) if self.positions[i] < 0), 26)
+        else:
+            self.whitePips -= count * position
+            self.whitesOutside -= count * (position > 6)
+            if position == self.whiteRear and self.positions[position] <= 0:
+                self.whiteRear = next((i for i in range(position - 1, -1, -1) if self.positions[i] > 0), -1)
     
     def applyMoves(self, player: int, moves: np.ndarray) -> int:
         """Applies the given moves to the board, changing the positions of the pieces
@@ -117,7 +339,9 @@ class BackgammonBoard():
         """
         # Apply the moves iteratively
         for move in moves:
-            self.applySingleMove(player, BackgammonParser().singleMoveToBoardMove(move))
+            self.makeMove(int(move[0]), int(move[1]), player)
+            if events.activeStream is not None:
+                events.activeStream.record("move", player=int(player), moves=[[int(move[0]), int(move[1])]])
         # Check if game is over
         if self.blacksHome == 15:
             return blackPlayer
@@ -141,40 +365,115 @@ class BackgammonBoard():
             # If taking pieces
             if move[i] < 0:
                 self.positions[i] += player * move[i]
+                self._removePieces(player, i, int(-move[i]))
                 if self.enableLogging:
-                    logging.debug(f"Player {player} takes {abs(move[i])} piece(s) from {i}")
+                    logger.debug("Player %s takes %s piece(s) from %s", player, abs(move[i]), i)
             # If putting pieces to home
             elif move[i] > 0 and i in [0, 25]:
                 # Black putting home
                 if i == 25:
                     self.blacksHome += move[i]
                     if self.enableLogging:
-                        logging.info(f"Black player ({player}) puts {move[i]} piece(s) home")
+                        logger.info("Black player (%s) puts %s piece(s) home", player, move[i])
                 # White putiing home
                 elif i == 0:
                     self.whitesHome += move[i]
                     if self.enableLogging:
-                        logging.info(f"White player ({player}) puts {move[i]} piece(s) home")
+                        logger.info("White player (%s) puts %s piece(s) home", player, move[i])
             # If putting pieces to own or empty field
             elif move[i] > 0 and np.sign(self.positions[i]) in [player, 0]:
                 self.positions[i] += player * move[i]
+                self._addPieces(player, i, int(move[i]))
                 if self.enableLogging:
-                    logging.debug(f"Player {player} puts {abs(move[i])} piece(s) to {i}")
+                    logger.debug("Player %s puts %s piece(s) to %s", player, abs(move[i]), i)
             # If putting pieces to contrary field
             elif move[i] > 0 and np.sign(self.positions[i]) == -player:
                 # If whites gets kicked
                 if player == blackPlayer:
                     self.positions[25] += whitePlayer
                     self.positions[i] = player * move[i]
+                    self._removePieces(whitePlayer, i, 1)
+                    self._addPieces(whitePlayer, 25, 1)
+                    self._addPieces(player, i, int(move[i]))
                     if self.enableLogging:
-                        logging.debug(f"Player {player} puts {abs(move[i])} piece(s) to {i} and kicks out player {-player}")
+                        logger.debug("Player %s puts %s piece(s) to %s and kicks out player %s", player, abs(move[i]), i, -player)
                 # If blacks gets kicked
                 if player == whitePlayer:
                     self.positions[0] += blackPlayer
                     self.positions[i] = player * move[i]
+                    self._removePieces(blackPlayer, i, 1)
+                    self._addPieces(blackPlayer, 0, 1)
+                    self._addPieces(player, i, int(move[i]))
                     if self.enableLogging:
-                        logging.debug(f"Player {player} puts {abs(move[i])} piece(s) to {i} and kicks out player {-player}")
-        
+                        logger.debug("Player %s puts %s piece(s) to %s and kicks out player %s", player, abs(move[i]), i, -player)
+
+    def makeMove(self, moveFrom: int, moveTo: int, player: int = None) -> tuple:
+        """Applies a single valid move in place, same as applySingleMove
+
+        Parameters
+        ----------
+        moveFrom : int
+            Position to move from
+        moveTo : int
+            Position to move to, 25 (0) to put a black (white) piece home
+        player : int
+            The player that does the move. Deduced from the piece at moveFrom if None
+
+        Returns
+        -------
+        tuple
+            Undo record to pass to unmakeMove
+        """
+        if player is None:
+            player = int(np.sign(self.positions[moveFrom]))
+            if player == 0:
+                raise ValueError(f"No piece to move at {moveFrom}")
+        blackRear, whiteRear = self.blackRear, self.whiteRear
+        hit = False
+        # Taking the piece
+        self.positions[moveFrom] -= player
+        self._removePieces(player, moveFrom, 1)
+        # Putting the piece home
+        if player == blackPlayer and moveTo == 25:
+            self.blacksHome += 1
+        elif player == whitePlayer and moveTo == 0:
+            self.whitesHome += 1
+        else:
+            # Kicking out the opponent, whites go to 25 and blacks go to 0
+            if self.positions[moveTo] * player < 0:
+                bar = 25 if player == blackPlayer else 0
+                self.positions[moveTo] = 0
+                self.positions[bar] -= player
+                self._removePieces(-player, moveTo, 1)
+                self._addPieces(-player, bar, 1)
+                hit = True
+            self.positions[moveTo] += player
+            self._addPieces(player, moveTo, 1)
+        if self.enableLogging:
+            logger.debug("Player %s moves from %s to %s%s", player, moveFrom, moveTo, " and kicks out the opponent" if hit else "")
+        return (player, moveFrom, moveTo, hit, blackRear, whiteRear)
+
+    def unmakeMove(self, record: tuple):
+        """Reverts a move applied with makeMove, the moves made after it have to be reverted first"""
+        player, moveFrom, moveTo, hit, blackRear, whiteRear = record
+        if player == blackPlayer and moveTo == 25:
+            self.blacksHome -= 1
+        elif player == whitePlayer and moveTo == 0:
+            self.whitesHome -= 1
+        else:
+            self.positions[moveTo] -= player
+            self._removePieces(player, moveTo, 1)
+            # Putting back the kicked out piece
+            if hit:
+                bar = 25 if player == blackPlayer else 0
+                self.positions[bar] += player
+                self.positions[moveTo] = -player
+                self._removePieces(-player, bar, 1)
+                self._addPieces(-player, moveTo, 1)
+        self.positions[moveFrom] += player
+        self._addPieces(player, moveFrom, 1)
+        self.blackRear, self.whiteRear = blackRear, whiteRear
+
     def display(self):
         print("|                                        | 1 | 1 | 1 |")
         print("| 0 || 1 | 2 | 3 | 4 | 5 | 6 | 7 | 8 | 9 | 0 | 1 | 2 |")
@@ -208,6 +507,117 @@ class BackgammonBoard():
         print("| 2 || 2 | 2 | 2 | 2 | 2 | 1 | 1 | 1 | 1 | 1 | 1 | 1 |")
         print("| 5 || 4 | 3 | 2 | 1 | 0 | 9 | 8 | 7 | 6 | 5 | 4 | 3 |")
 
+class BackgammonBatchBoard():
+    
+    def __init__(self, nGames: int) -> None:
+        self.positions = np.tile(BackgammonBoard().initialPositions().astype(np.int8), (nGames, 1))
+        self.blacksHome = np.zeros(nGames, dtype=np.int8)
+        self.whitesHome = np.zeros(nGames, dtype=np.int8)
+    
+    @classmethod
+    def fromBoards(cls, boards: list) -> "BackgammonBatchBoard":
+        """Creates a batch holding a copy of the given boards
+        
+        Parameters
+        ----------
+        boards : list[BackgammonBoard]
+            The boards of the games
+        """
+        batch = cls(len(boards))
+        for i, board in enumerate(boards):
+            batch.positions[i] = board.positions
+            batch.blacksHome[i] = board.blacksHome
+            batch.whitesHome[i] = board.whitesHome
+        return batch
+    
+    def __len__(self) -> int:
+        return len(self.positions)
+    
+    def getBoard(self, game: int) -> BackgammonBoard:
+        """Returns a copy of the given game as a BackgammonBoard"""
+        board = BackgammonBoard(logging=False)
+        board.setPositions(self.positions[game].astype(int))
+        board.blacksHome = int(self.blacksHome[game])
+        board.whitesHome = int(self.whitesHome[game])
+        return board
+    
+    def checkHits(self, players, moves: np.ndarray) -> np.ndarray:
+        """Checks which moves kick out a piece of the opponent
+        
+        Parameters
+        ----------
+        players : int or ndarray
+            The player that does the move, either for all games or as an array of shape (N,)
+        moves : ndarray
+            Array of shape (N,2) containing one move per game. Format: [from, to]
+            Games with a negative 'from' don't move
+        
+        Returns
+        -------
+        ndarray
+            Boolean array of shape (N,), True where the move kicks out a piece
+        """
+        players = np.broadcast_to(np.asarray(players, dtype=np.int8), (len(self),))
+        moveTo = np.clip(moves[:, 1], 0, 25)
+        # Moving out never kicks out
+        movingOut = ((players == blackPlayer) & (moveTo == 25)) | ((players == whitePlayer) & (moveTo == 0))
+        target = self.positions[np.arange(len(self)), moveTo]
+        return (moves[:, 0] >= 0) & ~movingOut & (target * players < 0)
+    
+    def applySingleMoves(self, players, moves: np.ndarray) -> np.ndarray:
+        """Applies one move per game to the whole batch, changing the positions of the pieces
+        
+        The moves are expected to be valid, see BackgammonRules.checkSingleMove
+        
+        Parameters
+        ----------
+        players : int or ndarray
+            The player that does the move, either for all games or as an array of shape (N,)
+        moves : ndarray
+            Array of shape (N,2) containing one move per game. Format: [from, to]
+            Games with a negative 'from' don't move
+        
+        Returns
+        -------
+        ndarray
+            Boolean array of shape (N,), True where the move kicked out a piece
+        """
+        players = np.broadcast_to(np.asarray(players, dtype=np.int8), (len(self),))
+        hits = self.checkHits(players, moves)
+        # Get the games that move
+        games = np.flatnonzero(moves[:, 0] >= 0)
+        moveFrom = moves[games, 0]
+        moveTo = moves[games, 1]
+        player = players[games]
+        # Take the pieces
+        self.positions[games, moveFrom] -= player
+        # Put pieces to home
+        blacksOut = (player == blackPlayer) & (moveTo == 25)
+        whitesOut = (player == whitePlayer) & (moveTo == 0)
+        self.blacksHome[games[blacksOut]] += 1
+        self.whitesHome[games[whitesOut]] += 1
+        # Kick out the opponent pieces, whites go to 25 and blacks go to 0
+        hitGames = np.flatnonzero(hits)
+        hitPlayer = players[hitGames]
+        self.positions[hitGames, np.where(hitPlayer == blackPlayer, 25, 0)] -= hitPlayer
+        self.positions[hitGames, moves[hitGames, 1]] = 0
+        # Put pieces to own or empty fields
+        onBoard = ~(blacksOut | whitesOut)
+        self.positions[games[onBoard], moveTo[onBoard]] += player[onBoard]
+        return hits
+    
+    def checkGamesOver(self) -> np.ndarray:
+        """Checks which games are over
+        
+        Returns
+        -------
+        ndarray
+            Array of shape (N,) containing
+            0 if the game is still on
+            blackPlayer (whitePlayer) if the Black (White) player has won
+        """
+        return np.where(self.blacksHome == 15, blackPlayer, np.where(self.whitesHome == 15, whitePlayer, 0)).astype(np.int8)
+
 class BackgammonParser():
     
     def __init__(self) -> None:
@@ -235,7 +645,7 @@ class BackgammonParser():
         moves = strMoves.split(";")
         # Check number of moves. Must be either 2 or 4
         if len(moves) not in [1,2,3,4]:
-            logging.debug(f"Invalid moves format '{strMoves}'")
+            logger.debug("Invalid moves format '%s'", strMoves)
             raise ValueError
         # Create return array
         arrMoves = np.empty((1,len(moves),2), dtype=int)
@@ -243,17 +653,17 @@ class BackgammonParser():
             move = moves[i].split(",")
             # Check that each move is complete
             if len(move) != 2:
-                logging.debug(f"Invalid move format '{moves[i]}'")
+                logger.debug("Invalid move format '%s'", moves[i])
                 raise ValueError
             # Try to cast the move
             try:
                 moveFrom, moveTo = [int(val) for val in move]
             except:
-                logging.debug(f"Move '{move.tolist()}' could not be casted to int")
+                logger.debug("Move '%s' could not be casted to int", move)
                 raise TypeError
             # Check range
-            if moveFrom not in range(26) and moveTo not in range(26):
-                logging.debug(f"Move '{move.tolist()}' values are out of range")
+            if moveFrom not in range(26) or moveTo not in range(26):
+                logger.debug("Move '%s' values are out of range", move)
                 raise ValueError
             # Write move to arrMoves
             arrMoves[0,i,0] = moveFrom
@@ -278,17 +688,17 @@ class BackgammonParser():
         """
         # Check shape of input
         if singleMove.shape != (2,):
-            logging.debug(f"Invalid move format {singleMove}")
+            logger.debug("Invalid move format %s", singleMove)
             raise ValueError
         # Try to cast the move
         try:
             singleMove = singleMove.astype(int)
         except:
-            logging.debug(f"Move '{singleMove}' could not be casted to int")
+            logger.debug("Move '%s' could not be casted to int", singleMove)
             raise TypeError
         # Check range
-        if singleMove[0] not in range(26) and singleMove[1] not in range(26):
-            logging.debug(f"Move '{singleMove}' values are out of range")
+        if singleMove[0] not in range(26) or singleMove[1] not in range(26):
+            logger.debug("Move '%s' values are out of range", singleMove)
             raise ValueError
         # Create return array
         boardMove = np.zeros(26)
@@ -420,58 +830,297 @@ class BackgammonRules():
         None 
             If no valid move is found
         """
+        # Get the legal plays indexed by their set of moves
+        legalPlays = self._walkLegalPlays(positions, player, diceRolls)
         # Iterate over the given moves
         for moves in arrMoves:
-            # Repeat diceRolls 2 times if pairs were rolled
-            if diceRolls[0] == diceRolls[1]:
-                diceRolls = np.repeat(diceRolls, 2)
-            # Create movesSteps array
-            movesSteps = moves[:,1] - moves[:,0]
-            # Check that the moves match the dice rolled
-            if not np.all(np.isin(abs(movesSteps), diceRolls)):
-                # Check if moving pieces out (to 0 or 25) and movesSteps are smaller than diceRolls
-                if np.any(moves[:,1] in [0, 25]) and np.all(np.sort(abs(movesSteps) <= np.sort(diceRolls))):
-                    pass
-                else:
-                    logging.debug(f"Moves {moves.tolist()} don't match the dice rolled {diceRolls}")
-                    continue
-            # Construct testBoard
-            testBoard = BackgammonBoard(logging=False)
-            # Check the permutations of the moves
-            for perm in multiset_permutations([x for x in range(len(moves))]):
-                # Create remainingRolls list (list is used because it has .remove() method)
-                remainingRolls = diceRolls.tolist()
-                # Set positions of testBoard
-                testBoard.setPositions(positions)
-                # Permute the moves
-                movesPerm = moves[perm]
-                movesPermNotValid = False
-                # Check that all single moves are valid
-                for i in range(len(movesPerm)):
-                    if self.checkSingleMove(testBoard.positions, player, movesPerm[i][0], movesPerm[i][1]):
-                        # Remove step from remainingRolls list
-                        remainingRolls.remove(abs(movesPerm[i][1] - movesPerm[i][0]))
-                        # If remainigRolls is empty
-                        if not remainingRolls:
-                            logging.debug(f"Moves {movesPerm.tolist()} are valid")
-                            return movesPerm
-                        # Apply the single move to the board
-                        testBoard.applySingleMove(player, BackgammonParser().singleMoveToBoardMove(movesPerm[i]))
-                    else:
-                        movesPermNotValid = True
-                        break
-                if movesPermNotValid:
-                    # If the previous loop was 'broken'
-                    logging.debug(f"Moves {movesPerm.tolist()} are not valid")
-                    continue
-                # movesPerm has less moves than possible
-                if not self.checkPossibleMoves(testBoard.positions, player, np.array(remainingRolls)):
-                    # If there are no more possible moves
-                    logging.debug(f"Moves {movesPerm.tolist()} are valid because no more moves are possible")
-                    return movesPerm
+            # The order of the moves doesn't matter for the lookup
+            key = movesKey(moves)
+            if key in legalPlays:
+                legalPlay = np.array(legalPlays[key][0], dtype=int).reshape(-1, 2)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Moves %s are valid", legalPlay.tolist())
+                return legalPlay
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Moves %s are not a legal play for dice %s", np.asarray(moves).tolist(), np.asarray(diceRolls).tolist())
+            if events.activeStream is not None:
+                events.activeStream.record("rejected", player=int(player), moves=np.asarray(moves).tolist(),
+                                           reason=f"not a legal play for dice {np.asarray(diceRolls).tolist()}")
         # No valid moves found
         return None
 
+    def generateLegalPlays(self, positions: np.ndarray, player: int, diceRolls: np.ndarray) -> list[np.ndarray]:
+        """Generate every distinct legal play given the positions, player and dice rolled
+        
+        Plays that lead to the same final positions are merged, only one of them is returned.
+        A play must use as many dice as possible. If only one die can be used, the larger one
+        has to be used when possible.
+        
+        Parameters
+        ----------
+        positions : ndarray
+            Array of shape (26,) containing the board positions
+        player : int
+            Player that makes the moves. Either blackPlayer or whitePlayer
+        diceRolls : ndarray
+            Array of shape (2,) containing the dice rolls
+        
+        Returns
+        -------
+        list[ndarray]
+            List of arrays of shape (m,2) containing the moves of each play in the order they are applied
+            Where m is the number of moves of the play (0 if no move is possible)
+        """
+        return self._distinctPlays(self._walkLegalPlays(positions, player, diceRolls))
+
+    def _distinctPlays(self, legalPlays: dict[tuple, tuple[list, tuple]]) -> list[np.ndarray]:
+        """Merge the plays of _walkLegalPlays leading to the same final positions"""
+        finalPlays = {}
+        for legalPlay, finalPositions in legalPlays.values():
+            finalPlays.setdefault(finalPositions, legalPlay)
+        return [np.array(legalPlay, dtype=int).reshape(-1, 2) for legalPlay in finalPlays.values()]
+
+    def legalMoveSets(self, positions: np.ndarray, player: int, diceRolls: np.ndarray) -> dict[tuple, np.ndarray]:
+        """Get the legal plays indexed by their sorted moves given the positions, player and dice rolled
+        
+        Parameters
+        ----------
+        positions : ndarray
+            Array of shape (26,) containing the board positions
+        player : int
+            Player that makes the moves. Either blackPlayer or whitePlayer
+        diceRolls : ndarray
+            Array of shape (2,) containing the dice rolls
+        
+        Returns
+        -------
+        dict[tuple, ndarray]
+            Keys are tuples with the sorted (from, to) moves of a legal play
+            Values are arrays of shape (m,2) containing the moves in an order they can be applied
+        """
+        return {movesKey: np.array(legalPlay, dtype=int).reshape(-1, 2) for movesKey, (legalPlay, _) in self._walkLegalPlays(positions, player, diceRolls).items()}
+
+    def legalFinalPositions(self, positions: np.ndarray, player: int, diceRolls: np.ndarray) -> set[tuple]:
+        """Get the distinct positions after the legal plays given the positions, player and dice rolled
+        
+        Returns
+        -------
+        set[tuple]
+            Final positions as tuples of length 26, pieces moved out are dropped
+        """
+        return {finalPositions for _, finalPositions in self._walkLegalPlays(positions, player, diceRolls).values()}
+
+    def _walkLegalPlays(self, positions: np.ndarray, player: int, diceRolls: np.ndarray) -> dict[tuple, tuple[list, tuple]]:
+        """Walk the tree of single moves and collect the legal plays
+        
+        Returns
+        -------
+        dict[tuple, tuple[list, tuple]]
+            Keys are tuples with the sorted (from, to) moves of a legal play
+            Values are the (from, to) moves in an order they can be applied and the final positions as tuple
+        """
+        # Repeat diceRolls 2 times if pairs were rolled
+        diceRolls = [int(die) for die in diceRolls]
+        if len(diceRolls) == 2 and diceRolls[0] == diceRolls[1]:
+            diceRolls = diceRolls * 2
+        # Leaves of the tree: sorted moves -> (moves, dice used to reach it, final positions)
+        leaves = {}
+        # Nodes already walked, reached by the same moves in another order
+        visited = set()
+        
+        def walk(nodePositions, moves, movesKey, usedDice, remainingRolls):
+            isLeaf = True
+            # The masks of the node are shared by its steps, the positions are restored after each child
+            masks = self.singleStepMasks(nodePositions, player) if remainingRolls else None
+            for step in set(remainingRolls):
+                # Remove step from remainingRolls
+                nextRolls = list(remainingRolls)
+                nextRolls.remove(step)
+                nextRolls = tuple(nextRolls)
+                for move in self._singleMovesForStep(nodePositions, player, step, masks):
+                    isLeaf = False
+                    nextMovesKey = tuple(sorted(movesKey + (move,)))
+                    if (nextMovesKey, nextRolls) in visited:
+                        continue
+                    visited.add((nextMovesKey, nextRolls))
+                    # Walk the child in place and undo the move afterwards
+                    hit = self.makeMoveOnList(nodePositions, player, move[0], move[1])
+                    walk(nodePositions, moves + [move], nextMovesKey, usedDice + [step], nextRolls)
+                    self.unmakeMoveOnList(nodePositions, player, move[0], move[1], hit)
+            if isLeaf:
+                leaves.setdefault(movesKey, (moves, set(), tuple(nodePositions)))[1].add(tuple(usedDice))
+        
+        walk([int(value) for value in positions], [], (), [], tuple(sorted(diceRolls)))
+        # A play must use as many dice as possible
+        maxMoves = max(len(moves) for moves, _, _ in leaves.values())
+        legalLeaves = {key: leaf for key, leaf in leaves.items() if len(leaf[0]) == maxMoves}
+        # If only one of two different dice can be used, it has to be the larger one
+        if maxMoves == 1 and len(diceRolls) == 2:
+            largerLeaves = {key: leaf for key, leaf in legalLeaves.items() if (max(diceRolls),) in leaf[1]}
+            if largerLeaves:
+                legalLeaves = largerLeaves
+        return {key: (moves, finalPositions) for key, (moves, _, finalPositions) in legalLeaves.items()}
+
+    def singleStepMasks(self, positions: list[int], player: int) -> tuple[int, int, int]:
+        """Bitmasks of the positions for the single step kernel, same as BackgammonBoard.masks
+        
+        Returns
+        -------
+        tuple[int, int, int]
+            Bit i is set if position i has pieces of the player, 5+ pieces of the player and 2+ pieces of the opponent
+        """
+        occupied = fullPoints = opponentMadePoints = 0
+        for i, value in enumerate(positions):
+            count = value * player
+            if count > 0:
+                occupied |= 1 << i
+                if count >= 5:
+                    fullPoints |= 1 << i
+            elif count <= -2:
+                opponentMadePoints |= 1 << i
+        return occupied, fullPoints, opponentMadePoints
+
+    def singleStepsFromMasks(self, occupied: int, fullPoints: int, opponentMadePoints: int, player: int,
+                             step: int) -> list[tuple[int, int]]:
+        """Get all the valid single moves of the player for the given step with shifts and ANDs on the masks
+        
+        Same checks as checkSingleMove: pieces kicked-out are moved first, a target can't have 5+ pieces of the
+        player nor 2+ of the opponent (also when moving out, to 25 or 0) and moving out needs all the pieces home.
+        A piece can be moved out with a step larger than needed if no piece of the player is further from the end
+        
+        Parameters
+        ----------
+        occupied, fullPoints, opponentMadePoints : int
+            Masks of the positions, see singleStepMasks
+        player : int
+            Player that makes the moves. Either blackPlayer or whitePlayer
+        step : int
+            The die
+        
+        Returns
+        -------
+        list[tuple[int, int]]
+            List of (from, to) moves, sorted by origin
+        """
+        blocked = fullPoints | opponentMadePoints
+        canMoveOut = not occupied & outsideHomeMasks[player]
+        singleMoves = []
+        if player == blackPlayer:
+            # Pieces kicked-out have to be moved first
+            origins = 1 if occupied & 1 else occupied
+            targets = (origins << step) & pointsMask & ~blocked
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                moveTo = target.bit_length() - 1
+                singleMoves.append((moveTo - step, moveTo))
+            if canMoveOut and not blocked >> 25 & 1:
+                if origins >> (25 - step) & 1:
+                    singleMoves.append((25 - step, 25))
+                else:
+                    # Moving out with a larger step than needed, only the rearmost piece
+                    rear = (origins & -origins).bit_length() - 1
+                    if rear + step > 25:
+                        singleMoves.append((rear, 25))
+        else:
+            origins = 1 << 25 if occupied >> 25 & 1 else occupied
+            if canMoveOut and not blocked & 1:
+                if origins >> step & 1:
+                    singleMoves.append((step, 0))
+                else:
+                    rear = origins.bit_length() - 1
+                    if 0 <= rear < step:
+                        singleMoves.append((rear, 0))
+            targets = (origins >> step) & pointsMask & ~blocked
+            while targets:
+                target = targets & -targets
+                targets ^= target
+                moveTo = target.bit_length() - 1
+                singleMoves.append((moveTo + step, moveTo))
+        return singleMoves
+
+    def _singleMovesForStep(self, positions: list[int], player: int, step: int, masks: tuple = None) -> list[tuple[int, int]]:
+        """Get the valid single moves of the player for the given step, see singleStepsFromMasks
+        
+        Returns
+        -------
+        list[tuple[int, int]]
+            List of (from, to) moves
+        """
+        if masks is None:
+            masks = self.singleStepMasks(positions, player)
+        return self.singleStepsFromMasks(*masks, player, step)
+
+    def legalSingleSteps(self, positions: np.ndarray, player: int, diceRolls: np.ndarray, masks: tuple = None) -> dict[int, list[tuple[int, int]]]:
+        """Get all the valid single moves of the player for each die rolled at once
+        
+        Parameters
+        ----------
+        positions : ndarray
+            Array of shape (26,) containing the board positions
+        player : int
+            Player that makes the moves. Either blackPlayer or whitePlayer
+        diceRolls : ndarray
+            Array of shape (n,) containing the dice rolls
+        masks : tuple
+            Masks of the positions if already known, e.g. BackgammonBoard.masks(player)
+        
+        Returns
+        -------
+        dict[int, list[tuple[int, int]]]
+            The (from, to) moves of every distinct die
+        """
+        if masks is None:
+            masks = self.singleStepMasks([int(value) for value in positions], player)
+        return {int(step): self.singleStepsFromMasks(*masks, player, int(step)) for step in diceRolls}
+
+    def makeMoveOnList(self, positions: list[int], player: int, moveFrom: int, moveTo: int) -> bool:
+        """Same as BackgammonBoard.makeMove on a list of positions, pieces moved out are dropped
+
+        Returns
+        -------
+        bool
+            True if the opponent was kicked out, needed by unmakeMoveOnList
+        """
+        positions[moveFrom] -= player
+        # Moving out
+        if (player == blackPlayer and moveTo == 25) or (player == whitePlayer and moveTo == 0):
+            return False
+        # Kicking out the opponent
+        hit = positions[moveTo] * player < 0
+        if hit:
+            positions[25 if player == blackPlayer else 0] -= player
+            positions[moveTo] = 0
+        positions[moveTo] += player
+        return hit
+
+    def unmakeMoveOnList(self, positions: list[int], player: int, moveFrom: int, moveTo: int, hit: bool):
+        """Reverts a move applied with makeMoveOnList"""
+        positions[moveFrom] += player
+        if (player == blackPlayer and moveTo == 25) or (player == whitePlayer and moveTo == 0):
+            return
+        positions[moveTo] -= player
+        if hit:
+            positions[25 if player == blackPlayer else 0] += player
+            positions[moveTo] = -player
+
+    def positionsAfterPlay(self, positions: list[int], player: int, moves) -> list[int]:
+        """Positions after the moves of a play, on a copy of a list of positions. Pieces moved out are dropped
+        
+        Parameters
+        ----------
+        positions : list[int]
+            List of length 26 containing the board positions, left unchanged
+        player : int
+            Player that makes the moves. Either blackPlayer or whitePlayer
+        moves : ndarray
+            Array of shape (m,2) containing the (from, to) moves, in an order they can be applied
+        """
+        positions = list(positions)
+        for moveFrom, moveTo in np.asarray(moves).reshape(-1, 2).tolist():
+            self.makeMoveOnList(positions, player, moveFrom, moveTo)
+        return positions
+
     def checkSingleMove(self, positions: np.ndarray, player: int, moveFrom: int, moveTo: int) -> bool:
         """Check if a single move is valid given the positions, the player and the positions to move from and to
         
@@ -495,60 +1144,55 @@ class BackgammonRules():
         """
         # Check boundary conditions
         if player != blackPlayer and player != whitePlayer:
-            logging.debug(f"Invalid player value: {player}")
-            return False
+            return self._rejectSingleMove(player, moveFrom, moveTo, "invalid player")
         if moveFrom not in range(len(positions)) or moveTo not in range(len(positions)):
-            logging.debug(f"Move from {moveFrom} to {moveTo} out of range")
-            return False
+            return self._rejectSingleMove(player, moveFrom, moveTo, "out of range")
         if abs(moveTo - moveFrom) > 6:
-            logging.debug(f"Move from {moveFrom} to {moveTo} too large")
-            return False
+            return self._rejectSingleMove(player, moveFrom, moveTo, "too large")
         # Check direction
         if player == blackPlayer and moveFrom > moveTo:
-            logging.debug(f"Move from {moveFrom} to {moveTo} invalid direction for player {player}")
-            return False
+            return self._rejectSingleMove(player, moveFrom, moveTo, "invalid direction")
         if player == whitePlayer and moveFrom < moveTo:
-            logging.debug(f"Move from {moveFrom} to {moveTo} invalid direction for player {player}")
-            return False
+            return self._rejectSingleMove(player, moveFrom, moveTo, "invalid direction")
         # Check if origin belongs to player
         if np.sign(positions[moveFrom]) != player:
-            logging.debug(f"Move from {moveFrom} invalid, position doesn't belong to player {player}")
-            return False
+            return self._rejectSingleMove(player, moveFrom, moveTo, "origin doesn't belong to player")
         # Check if target belongs to player and has 5+
         if np.sign(positions[moveTo]) == player and abs(positions[moveTo]) >= 5:
-            logging.debug(f"Move to {moveTo} invalid, position already has 5 pieces")
-            return False
+            return self._rejectSingleMove(player, moveFrom, moveTo, "target already has 5 pieces")
         # Check if target belongs to oponent and has 2+
         if np.sign(positions[moveTo]) != player and abs(positions[moveTo]) >= 2:
-            logging.debug(f"Move to {moveTo} invalid, position belongs to opponent and has 2+ pieces")
-            return False
+            return self._rejectSingleMove(player, moveFrom, moveTo, "target belongs to opponent and has 2+ pieces")
         # Check if moving 'out' is allowed - black
         if player == blackPlayer and moveTo == 25:
             # Check if all pieces are in the last 6 positions
             if np.any(np.sign(positions[:19]) == player):
-                logging.debug(f"Player {player} still has pieces out of home")
-                return False
+                return self._rejectSingleMove(player, moveFrom, moveTo, "pieces out of home")
         # Check if moving 'out' is allowed - white
         if player == whitePlayer and moveTo == 0:
             # Check if all pieces are in the last 6 positions
             if np.any(np.sign(positions[7:]) == player):
-                logging.debug(f"Player {player} still has pieces out of home")
-                return False
+                return self._rejectSingleMove(player, moveFrom, moveTo, "pieces out of home")
         # Check if pieces kicked-out - black
         if player == blackPlayer and np.sign(positions[0]) == blackPlayer:
             # Check if trying to moveFrom somewhere else
             if moveFrom != 0:
-                logging.debug(f"Player {player} has pieces kicked out")
-                return False
+                return self._rejectSingleMove(player, moveFrom, moveTo, "pieces kicked out")
         # Check if pieces kicked-out - white
         if player == whitePlayer and np.sign(positions[25]) == whitePlayer:
             # Check if trying to moveFrom somewhere else
             if moveFrom != 25:
-                logging.debug(f"Player {player} has pieces kicked out")
-                return False
+                return self._rejectSingleMove(player, moveFrom, moveTo, "pieces kicked out")
         # The move is valid
         return True
     
+    def _rejectSingleMove(self, player: int, moveFrom: int, moveTo: int, reason: str) -> bool:
+        """Logs and records why a single move is not valid, always returns False"""
+        logger.debug("Move from %s to %s invalid for player %s: %s", moveFrom, moveTo, player, reason)
+        if events.activeStream is not None:
+            events.activeStream.record("rejected", player=int(player), moves=[[int(moveFrom), int(moveTo)]], reason=reason)
+        return False
+    
     def checkPossibleMoves(self, positions: np.ndarray, player: int, diceRolls: np.ndarray) -> bool:
         """Check if there are possible moves given the positions, player and dice rolled
         
@@ -568,24 +1212,27 @@ class BackgammonRules():
             True if there are possible moves
             False if there are no possible moves
         """
-        # Iterate over the given diceRolls
-        for step in diceRolls:
-            # Get the positions where the player has pieces
-            playerOrigins = np.argwhere(np.sign(positions) == player)
-            # Get the positions where the player can move the pieces
-            playerDestins = playerOrigins - player * step
-            # Clip te values of playerDestins in case some are out of range
-            np.clip(playerDestins, 0, 25)
-            # Iterate over possible moves
-            for i in range(len(playerOrigins)):
-                if self.checkSingleMove(positions, player, playerOrigins[i], playerDestins[i]):
-                    # If possible move found
-                    logging.debug(f"Possible move found")
-                    return True
+        # All the single moves of every die at once
+        for step, singleMoves in self.legalSingleSteps(positions, player, diceRolls).items():
+            if singleMoves:
+                # If possible move found
+                logger.debug("Possible move found")
+                return True
         # No possible moves found
-        logging.debug(f"No possible moves found")
+        logger.debug("No possible moves found")
         return False
-        
 
 
-BackgammonGame()
+def main():
+    """Entry point of the terminal game, logging to backgammon.log"""
+    logging.basicConfig(filename="backgammon.log",
+                        filemode="w",
+                        encoding="utf-8",
+                        level=logging.DEBUG,
+                        format="%(asctime)s: %(levelname)s: %(message)s",
+                        datefmt="%d/%m/%Y %H:%M:%S")
+    BackgammonGame().play()
+
+
+if __name__ == "__main__":
+    main()
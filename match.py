@@ -0,0 +1,406 @@
+import os
+
+import numpy as np
+
+from dice import DiceSource
+from main import BackgammonGame, BackgammonRules, blackPlayer, whitePlayer
+from simulator import checkPolicyMoves
+
+defaultPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "matchequity.npz")
+
+# Probability that a game ends with a gammon, used to generate the table
+defaultGammonRate = 0.26
+# Version of the table files, the files of other versions are generated again
+tableVersion = 2
+# Share of the live cube chances in the cube decisions, the rest are the dead cube ones (Janowski's x)
+defaultCubeEfficiency = 0.68
+
+
+def _lookup(table: np.ndarray, away: int, opponentAway: int) -> float:
+    """Chances in the table, 1 (0) once the player (opponent) needs no more points"""
+    if away <= 0:
+        return 1.0
+    if opponentAway <= 0:
+        return 0.0
+    return table[away][opponentAway]
+
+
+def _gameChances(table: np.ndarray, away: int, opponentAway: int, outcomes: list) -> float:
+    """Chances before a game, outcomes are (points won by the player, negative if lost, probability)"""
+    return sum(probability * (_lookup(table, away - points, opponentAway) if points > 0
+                              else _lookup(table, away, opponentAway + points))
+               for points, probability in outcomes)
+
+
+def _winShares(probabilities) -> tuple[tuple, tuple]:
+    """Shares of the single, gammon and backgammon wins among the wins of the player, then of its opponent
+
+    probabilities are those of the game for the player, see outcomeProbabilities. A side without chances to win
+    only wins singles
+    """
+    outcomes = outcomeProbabilities(probabilities)
+    shares = []
+    for sign in (1, -1):
+        wins = [max(probability, 0.0) for points, probability in outcomes if points * sign > 0]
+        wins += [0.0] * (3 - len(wins))
+        total = sum(wins)
+        shares.append(tuple(win / total for win in wins) if total > 0 else (1.0, 0.0, 0.0))
+    return tuple(shares)
+
+
+class _LiveCube():
+    """Match winning chances with a live cube, as a function of the chances p of the player to win the game
+
+    The chances move continuously during the game, so that the cube is turned exactly at the take point of
+    the opponent and the chances are linear in p between the points where the cube is turned or the game
+    ends. The wins of each side are singles, gammons and backgammons in fixed shares (see _winShares). The
+    functions are memoized by score and cube, they only read the table at the scores after the game.
+    Side 0 is the player and side 1 its opponent, the functions called for the opponent swap the sides.
+    """
+
+    def __init__(self, table, winShares: tuple[tuple, tuple]) -> None:
+        self.table = table
+        self.winShares = winShares
+        # (away, opponentAway, cubeValue, side) -> (double point, chances at the double point, chances if lost)
+        self.ownedCubes = {}
+
+    def _win(self, away: int, opponentAway: int, cubeValue: int, side: int) -> float:
+        """Chances after winning the game at cubeValue"""
+        return sum(share * _lookup(self.table, away - points * cubeValue, opponentAway)
+                   for points, share in enumerate(self.winShares[side], 1))
+
+    def _lose(self, away: int, opponentAway: int, cubeValue: int, side: int) -> float:
+        """Chances after losing the game at cubeValue"""
+        return sum(share * _lookup(self.table, away, opponentAway - points * cubeValue)
+                   for points, share in enumerate(self.winShares[1 - side], 1))
+
+    def _ownedCube(self, away: int, opponentAway: int, cubeValue: int, side: int) -> tuple[float, float, float]:
+        """(double point, chances at the double point, chances if lost) of the player owning the cube
+
+        The player doubles once p reaches the take point of the opponent, and the opponent takes. It doesn't
+        double when the cube is dead or when playing on for the gammon is better, the double point is then 1
+        """
+        key = (away, opponentAway, cubeValue, side)
+        if key not in self.ownedCubes:
+            lose, win = self._lose(away, opponentAway, cubeValue, side), self._win(away, opponentAway, cubeValue, side)
+            doublePoint, doubleChances = 1.0, win
+            if cubeValue < away:
+                cash = _lookup(self.table, away - cubeValue, opponentAway)
+                takePoint = self.takePoint(away, opponentAway, 2 * cubeValue, cash, side)
+                if takePoint > 0 and (cash - lose) / takePoint >= win - lose:
+                    doublePoint, doubleChances = takePoint, cash
+            self.ownedCubes[key] = (doublePoint, doubleChances, lose)
+        return self.ownedCubes[key]
+
+    def owned(self, p: float, away: int, opponentAway: int, cubeValue: int, side: int = 0) -> float:
+        """Chances of the player owning the cube"""
+        doublePoint, doubleChances, lose = self._ownedCube(away, opponentAway, cubeValue, side)
+        return lose + (doubleChances - lose) * min(p / doublePoint, 1.0)
+
+    def opponentOwned(self, p: float, away: int, opponentAway: int, cubeValue: int, side: int = 0) -> float:
+        """Chances of the player when the opponent owns the cube"""
+        return 1 - self.owned(1 - p, opponentAway, away, cubeValue, 1 - side)
+
+    def takePoint(self, away: int, opponentAway: int, cubeValue: int, cash: float, side: int = 0) -> float:
+        """Chances p of the player from which the opponent owning the cube at cubeValue passes instead of getting
+        the player cash chances"""
+        doublePoint, doubleChances, lose = self._ownedCube(opponentAway, away, cubeValue, 1 - side)
+        # The opponent owning the cube gets 1 - cash, linear in 1 - p from lose up to its double point
+        if doubleChances <= lose:
+            return 1.0
+        return float(np.clip(1 - (1 - cash - lose) * doublePoint / (doubleChances - lose), 0, 1))
+
+    def centered(self, p: float, away: int, opponentAway: int, cubeValue: int = 1, side: int = 0) -> float:
+        """Chances with the cube in the middle, both players can double"""
+        # Right end: the player doubles and the opponent passes, or the player wins the game
+        cash = _lookup(self.table, away - cubeValue, opponentAway)
+        doublePoint = self.takePoint(away, opponentAway, 2 * cubeValue, cash, side)
+        rightEnds = [(1.0, self._win(away, opponentAway, cubeValue, side))]
+        if cubeValue < away:
+            rightEnds.append((doublePoint, cash))
+        # Left end: the opponent doubles and the player passes, or the player loses the game
+        opponentCash = 1 - _lookup(self.table, opponentAway - cubeValue, away)
+        opponentDoublePoint = 1 - self.takePoint(opponentAway, away, 2 * cubeValue, 1 - opponentCash, 1 - side)
+        leftEnds = [(0.0, self._lose(away, opponentAway, cubeValue, side))]
+        if cubeValue < opponentAway:
+            leftEnds.append((opponentDoublePoint, opponentCash))
+
+        def chances(left, right):
+            if p <= left[0]:
+                return left[1]
+            if p >= right[0]:
+                return right[1]
+            return left[1] + (right[1] - left[1]) * (p - left[0]) / (right[0] - left[0])
+        return max(min(chances(left, right) for left in leftEnds) for right in rightEnds)
+
+
+def generateMatchEquityTable(maxLength: int = 25, gammonRate: float = defaultGammonRate) -> tuple[np.ndarray, np.ndarray]:
+    """Match winning chances of every score of matches up to maxLength points
+
+    Games are played between equal players, ending with a gammon with probability gammonRate. Before the
+    Crawford game the cube is live, turned at the take point of the opponent (see _LiveCube). It isn't used in
+    the Crawford game (played once a or b is 1), and the trailer doubles at once in the games after it.
+
+    Returns
+    -------
+    tuple[ndarray, ndarray]
+        Arrays of shape (maxLength+1,maxLength+1) with the chances of the player needing a points to win the
+        match against an opponent needing b points, at [a,b]. The first one before and during the Crawford
+        game, the second one after it. Row 0 (column 0) is a won (lost) match
+    """
+    size = maxLength + 1
+    single, gammon = (1 - gammonRate) / 2, gammonRate / 2
+    outcomes = [(1, single), (2, gammon), (-1, single), (-2, gammon)]
+    doubledOutcomes = [(2 * points, probability) for points, probability in outcomes]
+    preCrawford = np.zeros((size, size))
+    postCrawford = np.zeros((size, size))
+    preCrawford[0, 1:] = postCrawford[0, 1:] = 1
+    liveCube = _LiveCube(preCrawford, ((1 - gammonRate, gammonRate, 0.0),) * 2)
+    # The chances of a score only depend on the scores with fewer points to go in total
+    for total in range(2, 2 * size - 1):
+        for away in range(max(1, total - maxLength), min(maxLength, total - 1) + 1):
+            opponentAway = total - away
+            if away == 1 or opponentAway == 1:
+                preCrawford[away, opponentAway] = _gameChances(postCrawford, away, opponentAway, outcomes)
+                postCrawford[away, opponentAway] = _gameChances(postCrawford, away, opponentAway,
+                                                                outcomes if away == opponentAway else doubledOutcomes)
+            else:
+                preCrawford[away, opponentAway] = liveCube.centered(0.5, away, opponentAway)
+    return preCrawford, postCrawford
+
+
+def writeMatchEquityTable(path: str = defaultPath, maxLength: int = 25, gammonRate: float = defaultGammonRate) -> str:
+    """Generates the table and saves it to path, returns the path"""
+    preCrawford, postCrawford = generateMatchEquityTable(maxLength, gammonRate)
+    np.savez(path, preCrawford=preCrawford, postCrawford=postCrawford, gammonRate=gammonRate, version=tableVersion)
+    return path
+
+
+def outcomeProbabilities(probabilities) -> list:
+    """(points won, negative if lost, probability) of the outcomes of a game
+
+    probabilities is either the probability to win, without gammons, or an array of shape (5,) with the
+    probabilities to win, win a gammon, win a backgammon, lose a gammon and lose a backgammon (see nn.outputNames)
+    """
+    if np.ndim(probabilities) == 0:
+        return [(1, float(probabilities)), (-1, 1 - float(probabilities))]
+    win, winGammon, winBackgammon, loseGammon, loseBackgammon = (float(value) for value in probabilities)
+    return [(1, win - winGammon), (2, winGammon - winBackgammon), (3, winBackgammon),
+            (-1, 1 - win - loseGammon), (-2, loseGammon - loseBackgammon), (-3, loseBackgammon)]
+
+
+class MatchEquityTable():
+    """Match winning chances of every score, generated once and cached on disk
+
+    The file is only read (or generated) at the first lookup, then all the lookups are list indexing.
+    """
+
+    def __init__(self, path: str = defaultPath, maxLength: int = 25, gammonRate: float = defaultGammonRate,
+                 generate: bool = True, cubeEfficiency: float = defaultCubeEfficiency) -> None:
+        """
+        Parameters
+        ----------
+        path : str
+            The table file, written by writeMatchEquityTable
+        maxLength : int
+            Longest match looked up. The table is generated again if the file has shorter matches
+        gammonRate : float
+            Probability of a gammon. The table is generated again if the file has another rate or version
+        generate : bool
+            Generate and save the table if the file doesn't exist or doesn't match
+        cubeEfficiency : float
+            Share of the live cube chances in the cube decisions, see cubeDecision
+        """
+        self.path = path
+        self.maxLength = maxLength
+        self.gammonRate = gammonRate
+        self.generate = generate
+        self.cubeEfficiency = cubeEfficiency
+        self._tables = None
+
+    def _load(self) -> tuple[list, list]:
+        if os.path.exists(self.path):
+            with np.load(self.path) as arrays:
+                if ("version" in arrays.files and int(arrays["version"]) == tableVersion
+                        and len(arrays["preCrawford"]) > self.maxLength and float(arrays["gammonRate"]) == self.gammonRate):
+                    return arrays["preCrawford"].tolist(), arrays["postCrawford"].tolist()
+        if not self.generate:
+            raise FileNotFoundError(f"Match equity table {self.path} not found, generate it with python match.py")
+        writeMatchEquityTable(self.path, self.maxLength, self.gammonRate)
+        return self._load()
+
+    @property
+    def tables(self) -> tuple[list, list]:
+        """The pre-Crawford and post-Crawford tables, see generateMatchEquityTable"""
+        if self._tables is None:
+            self._tables = self._load()
+        return self._tables
+
+    def equity(self, away: int, opponentAway: int, postCrawford: bool = False) -> float:
+        """Chances of the player needing away points to win the match against an opponent needing opponentAway points"""
+        return _lookup(self.tables[postCrawford], away, opponentAway)
+
+    def _afterGameTable(self, away: int, opponentAway: int, postCrawford: bool) -> list:
+        """Table of the scores after the current game, the games after the Crawford game are post-Crawford"""
+        return self.tables[postCrawford or away == 1 or opponentAway == 1]
+
+    def winningChances(self, probabilities, away: int, opponentAway: int, cubeValue: int = 1,
+                       postCrawford: bool = False) -> float:
+        """Chances to win the match if the current game is played to the end at the given cube value
+
+        probabilities are those of the game for the player, see outcomeProbabilities
+        """
+        outcomes = [(points * cubeValue, probability) for points, probability in outcomeProbabilities(probabilities)]
+        return _gameChances(self._afterGameTable(away, opponentAway, postCrawford), away, opponentAway, outcomes)
+
+    def cubeDecision(self, probabilities, away: int, opponentAway: int, cubeValue: int = 1,
+                     postCrawford: bool = False, centered: bool = True) -> dict:
+        """Doubling decision of the player on roll, and the take decision of its opponent
+
+        Before the Crawford game the chances are those of Janowski's model: cubeEfficiency times the live cube
+        chances (see _LiveCube) plus the rest times the dead cube chances, the game played to the end at the
+        cube value. So the player only doubles close to the take point of its opponent, or plays on when too
+        good, the gammons of the live cube in the shares of probabilities (see _winShares). After the Crawford
+        game the cube of the trailer is dead. The player doubles when it doesn't lose chances by doing so.
+
+        Parameters
+        ----------
+        probabilities
+            Chances of the game for the player, see outcomeProbabilities
+        away, opponentAway : int
+            Points the player and its opponent need to win the match
+        cubeValue : int
+            Value of the cube before the double
+        postCrawford : bool
+            Whether the Crawford game was played
+        centered : bool
+            Whether the cube is in the middle, otherwise the player owns it
+
+        Returns
+        -------
+        dict
+            The match winning chances of the player for "noDouble", "doubleTake" and "doublePass", whether the
+            player should "double" and whether the opponent should "take"
+        """
+        noDouble = self.winningChances(probabilities, away, opponentAway, cubeValue, postCrawford)
+        # No cube in the Crawford game
+        if not postCrawford and (away == 1 or opponentAway == 1):
+            return {"noDouble": noDouble, "doubleTake": noDouble, "doublePass": noDouble, "double": False, "take": True}
+        doubleTake = self.winningChances(probabilities, away, opponentAway, 2 * cubeValue, postCrawford)
+        doublePass = _lookup(self._afterGameTable(away, opponentAway, postCrawford), away - cubeValue, opponentAway)
+        if not postCrawford:
+            win = sum(probability for points, probability in outcomeProbabilities(probabilities) if points > 0)
+            # The gammons of the live cube are in the shares of the game
+            liveCube = _LiveCube(self.tables[0], _winShares(probabilities))
+            if centered:
+                liveNoDouble = liveCube.centered(win, away, opponentAway, cubeValue)
+            else:
+                liveNoDouble = liveCube.owned(win, away, opponentAway, cubeValue)
+            liveDoubleTake = liveCube.opponentOwned(win, away, opponentAway, 2 * cubeValue)
+            noDouble = (1 - self.cubeEfficiency) * noDouble + self.cubeEfficiency * liveNoDouble
+            doubleTake = (1 - self.cubeEfficiency) * doubleTake + self.cubeEfficiency * liveDoubleTake
+        take = doubleTake <= doublePass
+        return {"noDouble": noDouble, "doubleTake": doubleTake, "doublePass": doublePass,
+                "double": min(doubleTake, doublePass) >= noDouble, "take": take}
+
+    def takePoint(self, away: int, opponentAway: int, cubeValue: int = 1, postCrawford: bool = False) -> float:
+        """Minimum chances to win the game, without gammons, for the player to take a double of its opponent"""
+        table = self._afterGameTable(away, opponentAway, postCrawford)
+        drop = _lookup(table, away, opponentAway - cubeValue)
+        win = _lookup(table, away - 2 * cubeValue, opponentAway)
+        lose = _lookup(table, away, opponentAway - 2 * cubeValue)
+        return (drop - lose) / (win - lose) if win > lose else 0.0
+
+
+class MatchScore():
+    """Score of a match and its Crawford state"""
+
+    def __init__(self, length: int) -> None:
+        self.length = length
+        self.scores = {blackPlayer: 0, whitePlayer: 0}
+        # The Crawford game is the game after a player first needs 1 point
+        self.isCrawford = False
+        self.isPostCrawford = False
+
+    def away(self, player: int) -> int:
+        """Points the player needs to win the match"""
+        return max(self.length - self.scores[player], 0)
+
+    @property
+    def winner(self) -> int:
+        """The player who won the match, 0 while it is on"""
+        return next((player for player, score in self.scores.items() if score >= self.length), 0)
+
+    def addGame(self, winner: int, points: int):
+        if self.isCrawford:
+            self.isCrawford, self.isPostCrawford = False, True
+        elif not self.isPostCrawford and self.away(winner) > 1 and self.away(winner) - points == 1:
+            self.isCrawford = True
+        self.scores[winner] += points
+
+
+def playMatch(players: tuple, length: int, rng: np.random.Generator, evaluator=None, table: MatchEquityTable = None,
+              rules: BackgammonRules = None, dice: DiceSource = None, maxTurns: int = 10000) -> MatchScore:
+    """Plays a match, doubling according to the match equity table
+
+    Parameters
+    ----------
+    players : tuple
+        The (black, white) policies, see simulator.playGame
+    length : int
+        Points needed to win the match
+    rng : Generator
+        Random generator passed to the policies
+    evaluator : callable
+        Called as evaluator(board, player) before the player rolls, returns the probabilities of the game for
+        the player (see outcomeProbabilities). The cube isn't used if None
+    table : MatchEquityTable
+        Table of the cube decisions, the default one if None
+    rules : BackgammonRules
+        Rules used to generate the legal plays
+    dice : DiceSource
+        Source of the dice rolls, drawn from rng if None
+    maxTurns : int
+        Maximum number of turns of a game, the match is given up if a game isn't finished
+
+    Returns
+    -------
+    MatchScore
+        The final score, its winner is 0 if the match was given up
+    """
+    if table is None and evaluator is not None:
+        table = MatchEquityTable(maxLength=max(length, 25))
+    rules = rules if rules is not None else BackgammonRules()
+    dice = dice if dice is not None else DiceSource(rng)
+    policy = {blackPlayer: players[0], whitePlayer: players[1]}
+    score = MatchScore(length)
+    while score.winner == 0:
+        game = BackgammonGame(logging=False, dice=dice)
+        for _ in range(maxTurns):
+            player = game.whoseTurn
+            # Cube decision before rolling
+            if evaluator is not None and not score.isCrawford and game.canDouble(player) and game.cubeValue < score.away(player):
+                decision = table.cubeDecision(evaluator(game.board, player), score.away(player), score.away(-player),
+                                              game.cubeValue, score.isPostCrawford, game.cubeOwner == 0)
+                if decision["double"] and game.double(player, decision["take"]) != 0:
+                    break
+            diceRolls = game.dice.roll()
+            legalPlays = rules.generateLegalPlays(game.board.positions, player, diceRolls)
+            moves = checkPolicyMoves(rules, game.board, player, diceRolls, legalPlays,
+                                     policy[player](game.board, player, diceRolls, legalPlays, rng))
+            if game.playTurn(moves, diceRolls) != 0:
+                break
+        if not game.gameFinished:
+            return score
+        score.addGame(game.winner, game.points)
+    return score
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Generate the match equity table")
+    parser.add_argument("--path", default=defaultPath, help="table file")
+    parser.add_argument("--max-length", type=int, default=25, help="longest match of the table")
+    parser.add_argument("--gammon-rate", type=float, default=defaultGammonRate, help="probability of a gammon")
+    args = parser.parse_args()
+    print(f"Match equity table written to {writeMatchEquityTable(args.path, args.max_length, args.gammon_rate)}")
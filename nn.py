@@ -0,0 +1,154 @@
+import numpy as np
+
+from dataset import encodePositions, nFeatures
+from main import BackgammonBoard, BackgammonRules
+
+# Outputs of the network, probabilities for the player on roll of the encoded positions
+outputNames = ["win", "winGammon", "winBackgammon", "loseGammon", "loseBackgammon"]
+nOutputs = len(outputNames)
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-x))
+
+
+def equities(probabilities: np.ndarray) -> np.ndarray:
+    """Cubeless equities of an array of shape (N,nOutputs) of probabilities, in points per game"""
+    win, winGammon, winBackgammon, loseGammon, loseBackgammon = probabilities.T
+    return 2 * win - 1 + winGammon - loseGammon + winBackgammon - loseBackgammon
+
+
+def swapSides(probabilities: np.ndarray) -> np.ndarray:
+    """Probabilities of the opponent, an array of shape (N,nOutputs)"""
+    win, winGammon, winBackgammon, loseGammon, loseBackgammon = probabilities.T
+    return np.stack([1 - win, loseGammon, loseBackgammon, winGammon, winBackgammon], axis=1)
+
+
+class NeuralEvaluator():
+    """Feed-forward network evaluating positions encoded by dataset.encodePositions
+
+    Fully connected sigmoid layers in float32, evaluated on batches of positions so that all the
+    candidate plays of a roll are scored with one matrix multiply per layer.
+    """
+
+    def __init__(self, hiddenSizes: tuple = (80,), seed: int = None, rules: BackgammonRules = None) -> None:
+        """
+        Parameters
+        ----------
+        hiddenSizes : tuple
+            Number of units of every hidden layer
+        seed : int
+            Seed of the initial weights
+        rules : BackgammonRules
+            Rules applying the moves of the candidate plays
+        """
+        rng = np.random.default_rng(seed)
+        sizes = [nFeatures, *hiddenSizes, nOutputs]
+        self.weights = [(rng.standard_normal((nIn, nOut)) / np.sqrt(nIn)).astype(np.float32)
+                        for nIn, nOut in zip(sizes[:-1], sizes[1:])]
+        self.biases = [np.zeros(nOut, dtype=np.float32) for nOut in sizes[1:]]
+        self.rules = rules if rules is not None else BackgammonRules()
+
+    def forward(self, features: np.ndarray) -> np.ndarray:
+        """Probabilities (see outputNames) of an array of shape (N,nFeatures), returns an array of shape (N,nOutputs)"""
+        activations = np.asarray(features, dtype=np.float32)
+        for weights, biases in zip(self.weights, self.biases):
+            activations = _sigmoid(activations @ weights + biases)
+        return activations
+
+    def evaluate(self, positions: np.ndarray, players: np.ndarray) -> np.ndarray:
+        """Probabilities for the players on roll of an array of shape (N,26) of positions"""
+        return self.forward(encodePositions(positions, players))
+
+    def resultingPositions(self, positions: np.ndarray, player: int, legalPlays: list) -> np.ndarray:
+        """Positions after every play, an array of shape (len(legalPlays),26)"""
+        start = [int(value) for value in positions]
+        children = np.empty((len(legalPlays), 26), dtype=np.int16)
+        for i, legalPlay in enumerate(legalPlays):
+            children[i] = self.rules.positionsAfterPlay(start, player, legalPlay)
+        return children
+
+    def scorePlays(self, positions: np.ndarray, player: int, legalPlays: list) -> tuple[np.ndarray, np.ndarray]:
+        """Scores all the plays of a roll in one batch
+
+        Parameters
+        ----------
+        positions : ndarray
+            Array of shape (26,) containing the board positions
+        player : int
+            Player that makes the moves. Either blackPlayer or whitePlayer
+        legalPlays : list
+            The legal plays, arrays of shape (n,2), e.g. from BackgammonRules.generateLegalPlays
+
+        Returns
+        -------
+        tuple[ndarray, ndarray]
+            The equities (shape (len(legalPlays),)) and probabilities (shape (len(legalPlays),nOutputs)) of
+            every play, from the point of view of player
+        """
+        children = self.resultingPositions(positions, player, legalPlays)
+        # The opponent is on roll after the play
+        probabilities = swapSides(self.forward(encodePositions(children, -player)))
+        # Finished games, won with a gammon or a backgammon if the opponent has no piece home
+        board = BackgammonBoard()
+        for i in np.flatnonzero(~np.any(children * player > 0, axis=1)):
+            board.setPositions(children[i])
+            board.blacksHome = 15 + int(np.minimum(children[i], 0).sum())
+            board.whitesHome = 15 - int(np.maximum(children[i], 0).sum())
+            gameValue = board.gameValue(player)
+            probabilities[i] = (1, gameValue >= 2, gameValue == 3, 0, 0)
+        return equities(probabilities), probabilities
+
+    def __call__(self, board, player: int, diceRolls: np.ndarray, legalPlays: list, rng: np.random.Generator) -> np.ndarray:
+        """Policy interface, see simulator.playGame"""
+        if len(legalPlays) == 1:
+            return legalPlays[0]
+        playEquities, _ = self.scorePlays(board.positions, player, legalPlays)
+        return legalPlays[int(np.argmax(playEquities))]
+
+    def trainBatch(self, features: np.ndarray, targets: np.ndarray, learningRate: float = 0.1) -> float:
+        """One gradient descent step on the cross-entropy of a batch, returns its loss
+
+        Parameters
+        ----------
+        features : ndarray
+            Array of shape (N,nFeatures)
+        targets : ndarray
+            Array of shape (N,nOutputs) of target probabilities, e.g. 0 or 1 from the outcome of the games
+        learningRate : float
+            Step size
+        """
+        activations = [np.asarray(features, dtype=np.float32)]
+        for weights, biases in zip(self.weights, self.biases):
+            activations.append(_sigmoid(activations[-1] @ weights + biases))
+        outputs = np.clip(activations[-1], 1e-7, 1 - 1e-7)
+        targets = np.asarray(targets, dtype=np.float32)
+        loss = float(-np.mean(np.sum(targets * np.log(outputs) + (1 - targets) * np.log(1 - outputs), axis=1)))
+        # Sigmoid outputs with cross-entropy, the error of the output layer is outputs - targets
+        delta = (activations[-1] - targets) / len(targets)
+        for layer in reversed(range(len(self.weights))):
+            weightsGradient = activations[layer].T @ delta
+            biasesGradient = delta.sum(axis=0)
+            if layer > 0:
+                delta = (delta @ self.weights[layer].T) * activations[layer] * (1 - activations[layer])
+            self.weights[layer] -= learningRate * weightsGradient
+            self.biases[layer] -= learningRate * biasesGradient
+        return loss
+
+    def save(self, path: str):
+        """Saves the weights to a .npz file"""
+        arrays = {f"weights{layer}": weights for layer, weights in enumerate(self.weights)}
+        arrays.update({f"biases{layer}": biases for layer, biases in enumerate(self.biases)})
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str, rules: BackgammonRules = None) -> "NeuralEvaluator":
+        """Loads the weights saved by save"""
+        evaluator = cls(hiddenSizes=(), rules=rules)
+        with np.load(path) as arrays:
+            nLayers = len([name for name in arrays.files if name.startswith("weights")])
+            evaluator.weights = [arrays[f"weights{layer}"].astype(np.float32) for layer in range(nLayers)]
+            evaluator.biases = [arrays[f"biases{layer}"].astype(np.float32) for layer in range(nLayers)]
+        if evaluator.weights[0].shape[0] != nFeatures or evaluator.weights[-1].shape[1] != nOutputs:
+            raise ValueError(f"Weights of {path} don't match {nFeatures} features and {nOutputs} outputs")
+        return evaluator
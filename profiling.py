@@ -0,0 +1,162 @@
+import functools
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from cache import CachedBackgammonRules
+from main import BackgammonBoard, BackgammonParser, BackgammonRules
+
+# Profiler timing the rules engine, None when disabled
+activeProfiler = None
+
+# Methods timed while profiling: class -> method names. Only the methods defined by the class are wrapped,
+# so the overrides of the subclasses are listed as well
+timedMethods = {
+    BackgammonRules: ["checkMoves", "checkSingleMove", "checkPossibleMoves", "generateLegalPlays", "_walkLegalPlays"],
+    CachedBackgammonRules: ["checkPossibleMoves", "generateLegalPlays", "_walkLegalPlays"],
+    BackgammonBoard: ["applyMoves", "applySingleMove", "makeMove"],
+    BackgammonParser: ["strToArrayOfMoves", "singleMoveToBoardMove", "tupleToArrayOfMoves"],
+}
+# Methods counted as the single-step move checks (trials) of checkMoves, _singleMovesForStep is too hot to be timed
+trialMethods = {
+    BackgammonRules: ["_singleMovesForStep", "checkSingleMove"],
+}
+
+
+class Histogram():
+    """Count, sum and the last maxSamples values of a measure, for percentiles"""
+
+    def __init__(self, maxSamples: int = 100000) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=maxSamples)
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def percentile(self, q: float) -> float:
+        return float(np.percentile(self.samples, q)) if self.samples else 0.0
+
+    def snapshot(self) -> dict:
+        return {"count": self.count, "total": self.total,
+                "mean": self.total / self.count if self.count else 0.0,
+                "p50": self.percentile(50), "p99": self.percentile(99)}
+
+
+class Profiler():
+    """Call counts and latencies of the rules engine methods
+
+    The methods are only wrapped while the profiler is installed, they run unchanged otherwise.
+    Methods are timed inclusively, e.g. checkMoves includes the checkSingleMove calls it makes.
+    """
+
+    def __init__(self, maxSamples: int = 100000) -> None:
+        self.maxSamples = maxSamples
+        # Method name -> Histogram of the latencies in seconds
+        self.latencies = {}
+        # Histogram of the single-step move checks made by every checkMoves call
+        self.checkMovesTrials = Histogram(maxSamples)
+        self.trials = 0
+        self.originals = {}
+
+    def _timed(self, name: str, method):
+        latency = self.latencies.setdefault(name, Histogram(self.maxSamples))
+        countTrials = name == "BackgammonRules.checkMoves"
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            trials = self.trials
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                latency.add(time.perf_counter() - start)
+                if countTrials:
+                    self.checkMovesTrials.add(self.trials - trials)
+        return wrapper
+
+    def _counted(self, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            self.trials += 1
+            return method(*args, **kwargs)
+        return wrapper
+
+    def install(self):
+        """Wraps the methods of timedMethods and trialMethods"""
+        for cls, names in timedMethods.items():
+            for name in names:
+                self.originals[(cls, name)] = cls.__dict__[name]
+                setattr(cls, name, self._timed(f"{cls.__name__}.{name}", cls.__dict__[name]))
+        for cls, names in trialMethods.items():
+            for name in names:
+                self.originals.setdefault((cls, name), cls.__dict__[name])
+                setattr(cls, name, self._counted(cls.__dict__[name]))
+
+    def uninstall(self):
+        """Restores the original methods"""
+        for (cls, name), method in self.originals.items():
+            setattr(cls, name, method)
+        self.originals.clear()
+
+    def snapshot(self) -> dict:
+        """Counts, total, mean, p50 and p99 of every method (seconds) and of the checkMoves trials"""
+        return {"methods": {name: latency.snapshot() for name, latency in self.latencies.items()},
+                "checkMovesTrials": self.checkMovesTrials.snapshot()}
+
+    def toJson(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def toPrometheus(self) -> str:
+        """Snapshot in the Prometheus text exposition format"""
+        lines = ["# HELP backgammon_method_seconds Latency of the rules engine methods",
+                 "# TYPE backgammon_method_seconds summary"]
+        for name, latency in self.latencies.items():
+            for quantile in (50, 99):
+                lines.append(f'backgammon_method_seconds{{method="{name}",quantile="{quantile / 100}"}} {latency.percentile(quantile)!r}')
+            lines.append(f'backgammon_method_seconds_sum{{method="{name}"}} {latency.total!r}')
+            lines.append(f'backgammon_method_seconds_count{{method="{name}"}} {latency.count}')
+        lines += ["# HELP backgammon_checkmoves_trials Single-step move checks per checkMoves call",
+                  "# TYPE backgammon_checkmoves_trials summary"]
+        for quantile in (50, 99):
+            lines.append(f'backgammon_checkmoves_trials{{quantile="{quantile / 100}"}} {self.checkMovesTrials.percentile(quantile)!r}')
+        lines.append(f"backgammon_checkmoves_trials_sum {self.checkMovesTrials.total!r}")
+        lines.append(f"backgammon_checkmoves_trials_count {self.checkMovesTrials.count}")
+        return "\n".join(lines) + "\n"
+
+
+def enable(maxSamples: int = 100000) -> Profiler:
+    """Starts profiling into a new profiler and returns it"""
+    global activeProfiler
+    disable()
+    activeProfiler = Profiler(maxSamples)
+    activeProfiler.install()
+    return activeProfiler
+
+
+def disable():
+    """Stops profiling, the methods run unchanged again"""
+    global activeProfiler
+    if activeProfiler is not None:
+        activeProfiler.uninstall()
+        activeProfiler = None
+
+
+@contextmanager
+def profile(maxSamples: int = 100000):
+    """Profiles the block, e.g.
+
+    with profiling.profile() as profiler:
+        simulator.simulate(100)
+    print(profiler.toPrometheus())
+    """
+    profiler = enable(maxSamples)
+    try:
+        yield profiler
+    finally:
+        disable()
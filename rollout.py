@@ -0,0 +1,186 @@
+import os
+import time
+
+import numpy as np
+
+from ai import greedyPolicy
+from cache import CachedBackgammonRules
+from dice import DiceSource
+from main import BackgammonBoard, BackgammonGame, movesKey
+from simulator import playGame, processPool
+
+# The 36 rolls, the first roll of game i is firstRolls[i % 36]
+firstRolls = np.array([(die0, die1) for die0 in range(1, 7) for die1 in range(1, 7)], dtype=np.int8)
+
+
+class RolloutResult():
+
+    def __init__(self, outcomes: np.ndarray, elapsed: float) -> None:
+        # Equity of every game (rows) for every candidate (columns)
+        self.outcomes = outcomes
+        self.elapsed = elapsed
+
+    @property
+    def games(self) -> int:
+        return self.outcomes.shape[0]
+
+    @property
+    def equities(self) -> np.ndarray:
+        """Mean equity of every candidate"""
+        return self.outcomes.mean(axis=0)
+
+    @property
+    def standardErrors(self) -> np.ndarray:
+        """Standard error of the mean equity of every candidate"""
+        if self.games < 2:
+            return np.full(self.outcomes.shape[1], np.inf)
+        return self.outcomes.std(axis=0, ddof=1) / np.sqrt(self.games)
+
+    def differenceErrors(self, candidate: int) -> np.ndarray:
+        """Standard errors of the equity differences between the candidate and every other one
+
+        The games share their dice, so the errors of the differences are smaller than those of the equities
+        """
+        if self.games < 2:
+            return np.full(self.outcomes.shape[1], np.inf)
+        differences = self.outcomes - self.outcomes[:, [candidate]]
+        return differences.std(axis=0, ddof=1) / np.sqrt(self.games)
+
+    @property
+    def best(self) -> int:
+        return int(np.argmax(self.equities))
+
+    def isSeparated(self, z: float = 1.96) -> bool:
+        """True if the best candidate is better than every other one with the confidence level of z"""
+        equities = self.equities
+        best = self.best
+        margins = equities[best] - equities - z * self.differenceErrors(best)
+        margins[best] = np.inf
+        return bool(np.all(margins > 0))
+
+    def __str__(self) -> str:
+        lines = [f"{self.games} games per candidate in {self.elapsed:.2f}s"]
+        for candidate, (equity, error) in enumerate(zip(self.equities, self.standardErrors)):
+            lines.append(f"Candidate {candidate}: equity {equity:+.4f} +- {error:.4f}")
+        return "\n".join(lines)
+
+
+def _rolloutGames(positions: np.ndarray, blacksHome: int, whitesHome: int, player: int, candidates: list,
+                  gameIndices: range, entropy: int, policy, maxTurns: int) -> np.ndarray:
+    """Plays the games gameIndices of every candidate in the current process
+
+    Returns
+    -------
+    ndarray
+        Array of shape (len(gameIndices), number of candidates) with the equity of every game for player
+    """
+    rules = CachedBackgammonRules()
+    outcomes = np.zeros((len(gameIndices), max(len(candidates), 1)))
+    for row, game in enumerate(gameIndices):
+        # The same dice and policy choices for every candidate, the first roll is stratified
+        policySeed, diceSeed = np.random.SeedSequence(entropy, spawn_key=(game,)).spawn(2)
+        for column, candidate in enumerate(candidates or [None]):
+            backgammonGame = BackgammonGame(logging=False, dice=DiceSource.fromRolls(firstRolls[game % 36], seed=diceSeed))
+            board = backgammonGame.board
+            board.setPositions(positions)
+            board.blacksHome = blacksHome
+            board.whitesHome = whitesHome
+            backgammonGame.whoseTurn = player
+            if candidate is not None:
+                winner = backgammonGame.playTurn(candidate)
+                if winner != 0:
+                    outcomes[row, column] = winner * player * backgammonGame.points
+                    continue
+            winner, _ = playGame((policy, policy), np.random.default_rng(policySeed), game=backgammonGame,
+                                 maxTurns=maxTurns, rules=rules)
+            # Gammons and backgammons count 2 and 3 points, unfinished games 0
+            if winner != 0:
+                outcomes[row, column] = winner * player * backgammonGame.points
+    return outcomes
+
+
+def _checkCandidates(board: BackgammonBoard, player: int, candidates: list, diceRolls: np.ndarray) -> list:
+    """The candidates in an order their moves can be applied
+
+    Raises a ValueError if a candidate isn't a legal play of diceRolls, or of any roll if diceRolls is None.
+    The moves of a candidate can be given in any order
+    """
+    rules = CachedBackgammonRules()
+    rolls = [diceRolls] if diceRolls is not None else [roll for roll in firstRolls if roll[0] <= roll[1]]
+    legalPlays = {}
+    for roll in rolls:
+        legalPlays.update(rules.legalMoveSets(board.positions, player, roll))
+    orderedCandidates = []
+    for i, candidate in enumerate(candidates):
+        key = movesKey(candidate)
+        if key not in legalPlays:
+            raise ValueError(f"Candidate {i} {np.asarray(candidate).tolist()} isn't a legal play of player {player}")
+        orderedCandidates.append(legalPlays[key])
+    return orderedCandidates
+
+
+def rollout(board: BackgammonBoard, player: int, candidates: list = None, nGames: int = 1296, policy=greedyPolicy,
+            seed: int = None, workers: int = 1, batchSize: int = 36, z: float = 1.96, minGames: int = 144,
+            maxTurns: int = 10000, diceRolls: np.ndarray = None) -> RolloutResult:
+    """Estimates the equity of the positions, or of candidate plays, by playing games to completion
+
+    The candidates are compared on the same games: every game uses the same dice and the same seed of the
+    policy for all the candidates. The first roll of game i is the (i % 36)-th of the 36 rolls, so every
+    batch of 36 games covers them all. The equities are in points per game, gammons count 2 and backgammons 3.
+
+    Parameters
+    ----------
+    board : BackgammonBoard
+        Board with the positions to roll out
+    player : int
+        Player on roll, the equities are from its point of view. Either blackPlayer or whitePlayer
+    candidates : list
+        Plays of player (arrays of shape (m,2)) to compare. If None the player rolls first
+    nGames : int
+        Maximum number of games per candidate
+    policy : callable
+        Policy playing both sides, see simulator.playGame. It has to be picklable if workers > 1
+    seed : int
+        Seed of the dice and the policy
+    workers : int
+        Number of worker processes, as many as CPUs if None
+    batchSize : int
+        Games per task sent to a worker
+    z : float
+        The rollout stops once the best candidate is better than the others with this confidence (z-score)
+    minGames : int
+        Minimum number of games per candidate before stopping early
+    maxTurns : int
+        Maximum number of turns of a game, unfinished games count as equity 0
+    diceRolls : ndarray
+        Roll of the candidates, checked to be legal plays of it. Legal plays of any roll if None
+
+    Returns
+    -------
+    RolloutResult
+        The equity of every game of every candidate
+    """
+    start = time.perf_counter()
+    if nGames < 1:
+        raise ValueError(f"nGames must be at least 1, got {nGames}")
+    if candidates is not None:
+        candidates = _checkCandidates(board, player, candidates, diceRolls)
+    if workers is None:
+        workers = os.cpu_count()
+    entropy = np.random.SeedSequence(seed).entropy
+    arguments = (np.array(board.positions), int(board.blacksHome), int(board.whitesHome), player, candidates)
+    batches = [range(first, min(first + batchSize, nGames)) for first in range(0, nGames, batchSize)]
+    results = []
+    with processPool(workers) as executor:
+        # Rounds of one batch per worker, stopping early once the candidates are separated
+        for first in range(0, len(batches), workers):
+            roundBatches = batches[first:first + workers]
+            if executor is None:
+                results.extend(_rolloutGames(*arguments, batch, entropy, policy, maxTurns) for batch in roundBatches)
+            else:
+                futures = [executor.submit(_rolloutGames, *arguments, batch, entropy, policy, maxTurns) for batch in roundBatches]
+                results.extend(future.result() for future in futures)
+            result = RolloutResult(np.concatenate(results), time.perf_counter() - start)
+            if candidates is not None and len(candidates) > 1 and result.games >= minGames and result.isSeparated(z):
+                break
+    return result
@@ -0,0 +1,283 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from cache import CachedBackgammonRules
+from dice import DiceSource
+from main import BackgammonGame, BackgammonParser, blackPlayer, whitePlayer
+
+logger = logging.getLogger("backgammon.server")
+
+# Line protocol
+# -------------
+# Client to server, one command per line:
+#   NEW                       Start a new session, the client plays black. Answer: SESSION <id>
+#   JOIN <id>                 Join a session waiting for its second player, the client plays white
+#   MOVE from,to;from,to      Play the moves of the current turn, same format as the terminal game
+#   BOARD                     Send the board again
+#   QUIT                      Leave the session
+# Server to client:
+#   SESSION <id> <player>     Session joined, player is -1 (black) or 1 (white)
+#   BOARD <26 positions separated by ','> <blacksHome> <whitesHome>
+#   DICE <player> <die 0> <die 1>
+#   PASS <player> <die 0> <die 1>  The player can't move with its dice, replaces its DICE line
+#   MOVED <player> <moves>    The player played the moves
+#   WINNER <player>
+#   ERROR <message>
+
+
+class ClientError(Exception):
+    """Invalid command of a client, answered with an ERROR line"""
+
+
+class GameSession():
+    """A game between two connections"""
+
+    def __init__(self, sessionId: int, rules: CachedBackgammonRules) -> None:
+        self.sessionId = sessionId
+        self.rules = rules
+        # Small dice blocks, thousands of sessions are kept in memory
+        self.game = BackgammonGame(logging=False, dice=DiceSource(blockSize=64))
+        self.players = {}
+        self.diceRolls = None
+        self.lastActivity = time.monotonic()
+
+    @property
+    def isFull(self) -> bool:
+        return len(self.players) == 2
+
+    def boardLine(self) -> str:
+        board = self.game.board
+        return f"BOARD {','.join(str(int(value)) for value in board.positions)} {int(board.blacksHome)} {int(board.whitesHome)}"
+
+    def broadcast(self, line: str):
+        for connection in self.players.values():
+            connection.send(line)
+
+    def nextTurn(self):
+        """Rolls the dice of the player whose turn it is, passing the turns without possible moves"""
+        while True:
+            self.diceRolls = self.game.dice.roll()
+            player = self.game.whoseTurn
+            legalPlays = self.rules.generateLegalPlays(self.game.board.positions, player, self.diceRolls)
+            if len(legalPlays) == 1 and len(legalPlays[0]) == 0:
+                self.broadcast(f"PASS {player} {self.diceRolls[0]} {self.diceRolls[1]}")
+                self.game.playTurn(legalPlays[0], self.diceRolls)
+                continue
+            self.broadcast(self.boardLine())
+            self.broadcast(f"DICE {player} {self.diceRolls[0]} {self.diceRolls[1]}")
+            return
+
+    def playMoves(self, player: int, strMoves: str) -> int:
+        """Validates and plays the moves of the player, returns the winner or 0"""
+        if not self.isFull:
+            raise ClientError("waiting for the second player")
+        if player != self.game.whoseTurn:
+            raise ClientError("not your turn")
+        try:
+            arrMoves = BackgammonParser().strToArrayOfMoves(strMoves)
+            validMoves = self.rules.checkMoves(self.game.board.positions, arrMoves, player, self.diceRolls)
+        except (ValueError, TypeError, IndexError):
+            validMoves = None
+        if validMoves is None:
+            raise ClientError("invalid moves")
+        outcome = self.game.playTurn(validMoves, self.diceRolls)
+        self.broadcast(f"MOVED {player} {';'.join(f'{moveFrom},{moveTo}' for moveFrom, moveTo in validMoves.tolist())}")
+        if outcome != 0:
+            self.broadcast(self.boardLine())
+            self.broadcast(f"WINNER {outcome}")
+        else:
+            self.nextTurn()
+        return outcome
+
+
+class Connection():
+    """A client connection, holding at most one session"""
+
+    def __init__(self, server: "BackgammonServer", reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.session = None
+        self.player = None
+        self.closed = False
+
+    def send(self, line: str):
+        if self.closed:
+            return
+        self.writer.write(line.encode() + b"\n")
+        # Drop clients that don't read their updates
+        if self.writer.transport.get_write_buffer_size() > self.server.maxBufferedBytes:
+            logger.info("Closing connection with %d bytes buffered", self.writer.transport.get_write_buffer_size())
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+    def handleLine(self, line: str):
+        command, _, argument = line.strip().partition(" ")
+        command = command.upper()
+        if command == "NEW":
+            self.server.newSession(self)
+        elif command == "JOIN":
+            try:
+                sessionId = int(argument)
+            except ValueError:
+                raise ClientError("invalid session id")
+            self.server.joinSession(self, sessionId)
+        elif command == "MOVE":
+            if self.session is None:
+                raise ClientError("no session")
+            self.session.lastActivity = time.monotonic()
+            if self.session.playMoves(self.player, argument.strip()) != 0:
+                self.server.closeSession(self.session)
+        elif command == "BOARD":
+            if self.session is None:
+                raise ClientError("no session")
+            self.send(self.session.boardLine())
+        elif command == "QUIT":
+            self.close()
+        elif command:
+            raise ClientError(f"unknown command {command}")
+
+    async def serve(self):
+        try:
+            while not self.closed:
+                # Connections without a session are closed once idle, the sessions are evicted by the server
+                try:
+                    line = await asyncio.wait_for(self.reader.readline(),
+                                                  self.server.idleTimeout if self.session is None else None)
+                except asyncio.TimeoutError:
+                    self.send("ERROR idle timeout")
+                    break
+                except ValueError:
+                    # Line longer than the limit of the reader
+                    self.send("ERROR line too long")
+                    break
+                if not line:
+                    break
+                try:
+                    self.handleLine(line.decode(errors="replace"))
+                except ClientError as error:
+                    self.send(f"ERROR {error}")
+                if not self.closed:
+                    await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.close()
+            if self.session is not None:
+                self.server.closeSession(self.session, f"ERROR player {self.player} left")
+
+
+class BackgammonServer():
+    """asyncio server hosting many games, see the line protocol above"""
+
+    def __init__(self, idleTimeout: float = 600.0, maxLineLength: int = 256, maxBufferedBytes: int = 65536,
+                 maxSessions: int = 10000) -> None:
+        """
+        Parameters
+        ----------
+        idleTimeout : float
+            Seconds without moves after which a session is closed, and without commands after which a
+            connection without a session is closed
+        maxLineLength : int
+            Maximum length of a line sent by a client
+        maxBufferedBytes : int
+            Maximum bytes waiting to be sent to a client before it is disconnected
+        maxSessions : int
+            Maximum number of sessions open at the same time
+        """
+        self.idleTimeout = idleTimeout
+        self.maxLineLength = maxLineLength
+        self.maxBufferedBytes = maxBufferedBytes
+        self.maxSessions = maxSessions
+        self.sessions = {}
+        self.sessionIds = itertools.count(1)
+        # The legal plays are shared between all the sessions
+        self.rules = CachedBackgammonRules()
+
+    def newSession(self, connection: Connection):
+        if connection.session is not None:
+            raise ClientError("already in a session")
+        if len(self.sessions) >= self.maxSessions:
+            raise ClientError("too many sessions")
+        session = GameSession(next(self.sessionIds), self.rules)
+        self.sessions[session.sessionId] = session
+        session.players[blackPlayer] = connection
+        connection.session, connection.player = session, blackPlayer
+        connection.send(f"SESSION {session.sessionId} {blackPlayer}")
+
+    def joinSession(self, connection: Connection, sessionId: int):
+        if connection.session is not None:
+            raise ClientError("already in a session")
+        session = self.sessions.get(sessionId)
+        if session is None:
+            raise ClientError("unknown session")
+        if session.isFull:
+            raise ClientError("session is full")
+        session.players[whitePlayer] = connection
+        session.lastActivity = time.monotonic()
+        connection.session, connection.player = session, whitePlayer
+        connection.send(f"SESSION {session.sessionId} {whitePlayer}")
+        session.nextTurn()
+
+    def closeSession(self, session: GameSession, line: str = None):
+        """Removes the session and closes its connections, sending them line first if given"""
+        if self.sessions.pop(session.sessionId, None) is None:
+            return
+        for connection in session.players.values():
+            if line is not None:
+                connection.send(line)
+            connection.session = None
+            connection.close()
+
+    def evictIdleSessions(self) -> int:
+        """Closes the sessions without activity for idleTimeout seconds, returns how many"""
+        now = time.monotonic()
+        idle = [session for session in self.sessions.values() if now - session.lastActivity > self.idleTimeout]
+        for session in idle:
+            self.closeSession(session, "ERROR idle session closed")
+        if idle:
+            logger.info("Evicted %d idle sessions", len(idle))
+        return len(idle)
+
+    async def _evictionLoop(self):
+        while True:
+            await asyncio.sleep(self.idleTimeout / 4)
+            self.evictIdleSessions()
+
+    async def _handleClient(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await Connection(self, reader, writer).serve()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, path: str = None):
+        """Serves forever on the TCP host and port, or on the Unix socket path if given"""
+        if path is not None:
+            server = await asyncio.start_unix_server(self._handleClient, path, limit=self.maxLineLength)
+        else:
+            server = await asyncio.start_server(self._handleClient, host, port, limit=self.maxLineLength)
+        logger.info("Serving on %s", path if path is not None else f"{host}:{port}")
+        evictionTask = asyncio.create_task(self._evictionLoop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            evictionTask.cancel()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Host backgammon games over TCP or a Unix socket")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port")
+    parser.add_argument("--unix", default=None, help="Unix socket path, used instead of TCP if given")
+    parser.add_argument("--idle-timeout", type=float, default=600.0, help="seconds before idle sessions are closed")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(BackgammonServer(idleTimeout=args.idle_timeout).serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
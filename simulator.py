@@ -0,0 +1,224 @@
+import os
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from dice import DiceSource
+from gamerecord import GameRecordWriter
+from main import BackgammonGame, BackgammonRules, blackPlayer, movesKey, whitePlayer
+
+
+def randomPolicy(board, player: int, diceRolls: np.ndarray, legalPlays: list, rng: np.random.Generator) -> np.ndarray:
+    """Chooses one of the legal plays at random"""
+    return legalPlays[rng.integers(len(legalPlays))]
+
+
+def firstPlayPolicy(board, player: int, diceRolls: np.ndarray, legalPlays: list, rng: np.random.Generator) -> np.ndarray:
+    """Chooses the first legal play"""
+    return legalPlays[0]
+
+
+def _greedyPolicy():
+    # Imported when selected, ai loads the bear-off table and cache modules
+    from ai import greedyPolicy
+    return greedyPolicy
+
+
+def _expectiminimaxPolicy():
+    from ai import ExpectiminimaxPlayer
+    return ExpectiminimaxPlayer(timeBudget=0.1)
+
+
+# Policies that can be selected by name from the command line: name -> function creating the policy
+policies = {"random": lambda: randomPolicy,
+            "first": lambda: firstPlayPolicy,
+            "greedy": _greedyPolicy,
+            "expectiminimax": _expectiminimaxPolicy}
+
+
+def getPolicy(name: str):
+    """Creates the policy registered under name in policies"""
+    return policies[name]()
+
+
+class SimulationResult():
+
+    def __init__(self, winners: np.ndarray, turns: np.ndarray, elapsed: float) -> None:
+        self.winners = winners
+        self.turns = turns
+        self.elapsed = elapsed
+
+    @property
+    def games(self) -> int:
+        return len(self.winners)
+
+    @property
+    def blackWins(self) -> int:
+        return int(np.sum(self.winners == blackPlayer))
+
+    @property
+    def whiteWins(self) -> int:
+        return int(np.sum(self.winners == whitePlayer))
+
+    @property
+    def unfinished(self) -> int:
+        return int(np.sum(self.winners == 0))
+
+    @property
+    def gamesPerSecond(self) -> float:
+        return self.games / self.elapsed if self.elapsed > 0 else float("inf")
+
+    def __str__(self) -> str:
+        return (f"{self.games} games in {self.elapsed:.2f}s ({self.gamesPerSecond:.1f} games/s)\n"
+                f"Black wins: {self.blackWins} ({self.blackWins / max(self.games, 1):.1%})\n"
+                f"White wins: {self.whiteWins} ({self.whiteWins / max(self.games, 1):.1%})\n"
+                f"Unfinished: {self.unfinished}\n"
+                f"Mean turns per game: {np.mean(self.turns) if self.games else 0:.1f}")
+
+
+def checkPolicyMoves(rules: BackgammonRules, board, player: int, diceRolls: np.ndarray, legalPlays: list,
+                     moves: np.ndarray) -> np.ndarray:
+    """The moves chosen by a policy, in an order they can be applied
+
+    The moves can be any legal play of the roll, in any order. Raises a ValueError if they aren't one
+    """
+    moves = np.asarray(moves)
+    if any(np.array_equal(moves, legalPlay) for legalPlay in legalPlays):
+        return moves
+    # Another play with the same final positions, or the moves of a legal play in another order
+    legalMoves = rules.legalMoveSets(board.positions, player, diceRolls).get(movesKey(moves))
+    if legalMoves is None:
+        raise ValueError(f"Policy of player {player} chose the illegal moves {moves.tolist()}")
+    return legalMoves
+
+
+@contextmanager
+def processPool(workers: int):
+    """Pool of workers processes for the block, None if workers is 1"""
+    if workers <= 1:
+        yield None
+        return
+    # Imported here, multiprocessing is slow to import and not needed by single process runs
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield executor
+
+
+def playGame(players: tuple, rng: np.random.Generator, game: BackgammonGame = None, maxTurns: int = 10000,
+             rules: BackgammonRules = None, dice: DiceSource = None, recorder: GameRecordWriter = None) -> tuple[int, int]:
+    """Plays a complete game without any terminal I/O
+
+    Parameters
+    ----------
+    players : tuple
+        The (black, white) policies. A policy is called as policy(board, player, diceRolls, legalPlays, rng)
+        and returns one of the legalPlays
+    rng : Generator
+        Random generator passed to the policies
+    game : BackgammonGame
+        Game to continue playing, with its own dice. A new game is started if None
+    maxTurns : int
+        Maximum number of turns before the game is given up as unfinished
+    rules : BackgammonRules
+        Rules used to generate the legal plays, e.g. a CachedBackgammonRules shared between games
+    dice : DiceSource
+        Source of the dice rolls of a new game. Drawn from rng if None
+    recorder : GameRecordWriter
+        Writer a new game is recorded to, if any
+
+    Returns
+    -------
+    tuple[int, int]
+        The winner (blackPlayer, whitePlayer or 0 if unfinished) and the number of turns played
+    """
+    if game is None:
+        game = BackgammonGame(logging=False, dice=dice if dice is not None else DiceSource(rng), recorder=recorder)
+    if rules is None:
+        rules = BackgammonRules()
+    policy = {blackPlayer: players[0], whitePlayer: players[1]}
+    for turn in range(maxTurns):
+        # Generate the dice rolls
+        diceRolls = game.dice.roll()
+        legalPlays = rules.generateLegalPlays(game.board.positions, game.whoseTurn, diceRolls)
+        # Let the policy choose and check that it chose a legal play
+        moves = checkPolicyMoves(rules, game.board, game.whoseTurn, diceRolls, legalPlays,
+                                 policy[game.whoseTurn](game.board, game.whoseTurn, diceRolls, legalPlays, rng))
+        outcome = game.playTurn(moves, diceRolls)
+        if outcome != 0:
+            return outcome, turn + 1
+    if game.recorder is not None and game.recording:
+        game.recorder.endGame(0)
+    return 0, maxTurns
+
+
+def _simulateGames(nGames: int, players: tuple, seedSequence: np.random.SeedSequence, record: bool = False) -> tuple:
+    """Plays nGames games in the current process, returns the winners, turns and recorded games (see GameRecordWriter.getGames)"""
+    # Independent streams for the policies and the dice
+    policiesSeed, diceSeed = seedSequence.spawn(2)
+    rng = np.random.default_rng(policiesSeed)
+    dice = DiceSource(diceSeed)
+    winners = np.zeros(nGames, dtype=np.int8)
+    turns = np.zeros(nGames, dtype=np.int32)
+    # Games are recorded in memory and written to the file by the parent process
+    recorder = GameRecordWriter() if record else None
+    for i in range(nGames):
+        winners[i], turns[i] = playGame(players, rng, dice=dice, recorder=recorder)
+    return winners, turns, recorder.getGames() if record else None
+
+
+def simulate(nGames: int, players: tuple = (randomPolicy, randomPolicy), seed: int = None, workers: int = 1,
+             recordPath: str = None) -> SimulationResult:
+    """Plays nGames complete games between the given policies, spread over a process pool
+
+    Parameters
+    ----------
+    nGames : int
+        Number of games to play
+    players : tuple
+        The (black, white) policies, see playGame. They have to be picklable if workers > 1
+    seed : int
+        Seed of the simulation. Each worker gets its own independent seed derived from it
+    workers : int
+        Number of worker processes. The games are played in the current process if 1,
+        and in as many processes as CPUs if None
+    recordPath : str
+        Game record file the games are appended to, if any
+
+    Returns
+    -------
+    SimulationResult
+        The winner and number of turns of every game, and the elapsed time
+    """
+    start = time.perf_counter()
+    if workers is None:
+        workers = os.cpu_count()
+    workers = max(1, min(workers, nGames))
+    # Split the games and the seeds between the workers
+    chunks = [len(chunk) for chunk in np.array_split(np.arange(nGames), workers)]
+    seedSequences = np.random.SeedSequence(seed).spawn(workers)
+    if workers == 1:
+        results = [_simulateGames(chunks[0], players, seedSequences[0], recordPath is not None)]
+    else:
+        with processPool(workers) as executor:
+            results = list(executor.map(_simulateGames, chunks, [players] * workers, seedSequences, [recordPath is not None] * workers))
+    if recordPath is not None:
+        with GameRecordWriter(recordPath) as writer:
+            for result in results:
+                writer.appendGames(*result[2])
+    winners = np.concatenate([result[0] for result in results])
+    turns = np.concatenate([result[1] for result in results])
+    return SimulationResult(winners, turns, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Play headless backgammon games between policies")
+    parser.add_argument("--games", type=int, default=100, help="number of games to play")
+    parser.add_argument("--black", choices=policies, default="random", help="policy of the black player")
+    parser.add_argument("--white", choices=policies, default="random", help="policy of the white player")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the simulation")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--record", default=None, help="game record file the games are appended to")
+    args = parser.parse_args()
+    print(simulate(args.games, (getPolicy(args.black), getPolicy(args.white)), args.seed, args.workers, args.record))
@@ -0,0 +1,283 @@
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from cache import CachedBackgammonRules
+from dice import DiceSource
+from main import BackgammonGame, blackPlayer, whitePlayer
+from simulator import getPolicy, playGame, policies, processPool
+
+schedules = ("roundrobin", "swiss")
+
+# Elo points per unit of the logistic scale of the ratings
+eloScale = 400 / np.log(10)
+
+
+def _playMatch(players: tuple, nGames: int, entropy: int, spawnKey: tuple, maxTurns: int) -> list:
+    """Plays the games of a match in the current process, the players alternate colors
+
+    Returns the points of every game from the point of view of players[0] (see BackgammonBoard.gameValue):
+    positive if it won, negative if it lost and 0 if unfinished.
+    """
+    policiesSeed, diceSeed = np.random.SeedSequence(entropy, spawn_key=spawnKey).spawn(2)
+    rng = np.random.default_rng(policiesSeed)
+    dice = DiceSource(diceSeed)
+    rules = CachedBackgammonRules()
+    points = []
+    for i in range(nGames):
+        # The first player plays black in even games
+        colors = (blackPlayer, whitePlayer) if i % 2 == 0 else (whitePlayer, blackPlayer)
+        game = BackgammonGame(logging=False, dice=dice)
+        winner, _ = playGame(players if i % 2 == 0 else players[::-1], rng, game=game, maxTurns=maxTurns, rules=rules)
+        if winner == 0:
+            points.append(0)
+        else:
+            points.append(game.board.gameValue(winner) * (1 if winner == colors[0] else -1))
+    return points
+
+
+class TournamentResult():
+
+    def __init__(self, names: list, matches: list, elapsed: float) -> None:
+        self.names = names
+        # Finished matches, dicts with the round, the two players and the points of every game
+        self.matches = matches
+        self.elapsed = elapsed
+
+    def _pairResults(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Games won, gammons (or more) won and finished games of every player (rows) against every other (columns)"""
+        nPlayers = len(self.names)
+        wins = np.zeros((nPlayers, nPlayers))
+        gammons = np.zeros((nPlayers, nPlayers))
+        games = np.zeros((nPlayers, nPlayers))
+        for match in self.matches:
+            first, second = (self.names.index(name) for name in match["players"])
+            points = np.array(match["points"])
+            wins[first, second] += np.sum(points > 0)
+            wins[second, first] += np.sum(points < 0)
+            gammons[first, second] += np.sum(points >= 2)
+            gammons[second, first] += np.sum(points <= -2)
+            games[first, second] += np.sum(points != 0)
+            games[second, first] += np.sum(points != 0)
+        return wins, gammons, games
+
+    def ratings(self, prior: float = 0.1) -> tuple[np.ndarray, np.ndarray]:
+        """Elo ratings of the players, by maximum likelihood, and their standard errors
+
+        The probability that player i beats player j is 1 / (1 + 10 ** ((r_j - r_i) / 400)). A weak Gaussian
+        prior (in units of the logistic scale) keeps the ratings finite for unbeaten or winless players, the
+        ratings average 0.
+        """
+        wins, _, games = self._pairResults()
+        nPlayers = len(self.names)
+        strengths = np.zeros(nPlayers)
+        for _ in range(100):
+            # Newton steps on the log-likelihood
+            probabilities = 1 / (1 + np.exp(strengths[None, :] - strengths[:, None]))
+            gradient = (wins - games * probabilities).sum(axis=1) - prior * strengths
+            weights = games * probabilities * (1 - probabilities)
+            hessian = np.diag(weights.sum(axis=1) + prior) - weights
+            step = np.linalg.solve(hessian, gradient)
+            strengths += step
+            if np.max(np.abs(step)) < 1e-9:
+                break
+        covariance = np.linalg.inv(hessian)
+        # Ratings relative to the mean
+        centering = np.eye(nPlayers) - 1 / nPlayers
+        standardErrors = np.sqrt(np.maximum(np.diag(centering @ covariance @ centering.T), 0))
+        return (strengths - strengths.mean()) * eloScale, standardErrors * eloScale
+
+    def standings(self, z: float = 1.96) -> list:
+        """Dicts of the rating, win rate and gammon rate (per game) of every player with the half-widths of their
+        confidence intervals, best rated first"""
+        wins, gammons, games = self._pairResults()
+        ratings, ratingErrors = self.ratings()
+        standings = []
+        for i, name in enumerate(self.names):
+            nGames = games[i].sum()
+            winRate = wins[i].sum() / nGames if nGames else 0.0
+            gammonRate = gammons[i].sum() / nGames if nGames else 0.0
+            halfWidth = (lambda rate: z * np.sqrt(rate * (1 - rate) / nGames) if nGames else np.inf)
+            standings.append({"name": name, "games": int(nGames),
+                              "elo": float(ratings[i]), "eloError": float(z * ratingErrors[i]),
+                              "winRate": float(winRate), "winRateError": float(halfWidth(winRate)),
+                              "gammonRate": float(gammonRate), "gammonRateError": float(halfWidth(gammonRate))})
+        return sorted(standings, key=lambda standing: -standing["elo"])
+
+    def __str__(self) -> str:
+        lines = [f"{len(self.matches)} matches in {self.elapsed:.2f}s",
+                 f"{'Player':<20} {'Games':>6} {'Elo':>14} {'Win rate':>16} {'Gammon rate':>16}"]
+        for standing in self.standings():
+            lines.append(f"{standing['name']:<20} {standing['games']:>6} "
+                         f"{standing['elo']:>7.0f} ±{standing['eloError']:<5.0f} "
+                         f"{standing['winRate']:>8.1%} ±{standing['winRateError']:<6.1%} "
+                         f"{standing['gammonRate']:>8.1%} ±{standing['gammonRateError']:<6.1%}")
+        return "\n".join(lines)
+
+
+class Tournament():
+    """Tournament between policies, playing matches concurrently and checkpointing every finished match
+
+    Round-robin tournaments pair every player with every other one in every round. Swiss tournaments pair
+    players with close scores who haven't met yet, round after round.
+    """
+
+    def __init__(self, players: dict, gamesPerMatch: int = 100, rounds: int = 1, schedule: str = "roundrobin",
+                 seed: int = None, workers: int = 1, checkpointPath: str = None, maxTurns: int = 10000) -> None:
+        """
+        Parameters
+        ----------
+        players : dict
+            The policies by name, see simulator.playGame. They have to be picklable if workers > 1
+        gamesPerMatch : int
+            Number of games of a match, the players alternate colors
+        rounds : int
+            Number of rounds. Every player meets every other one in each round of a round-robin
+        schedule : str
+            "roundrobin" or "swiss"
+        seed : int
+            Seed of the tournament, every match gets its own seed derived from it
+        workers : int
+            Number of worker processes, as many as CPUs if None
+        checkpointPath : str
+            JSON lines file the finished matches are appended to. An existing checkpoint of the same tournament
+            is resumed, its matches aren't played again
+        maxTurns : int
+            Maximum number of turns of a game, unfinished games count for nobody
+        """
+        if schedule not in schedules:
+            raise ValueError(f"Unknown schedule {schedule}, expected one of {schedules}")
+        if len(players) < 2:
+            raise ValueError("A tournament needs at least 2 players")
+        self.players = players
+        self.names = list(players)
+        self.gamesPerMatch = gamesPerMatch
+        self.rounds = rounds
+        self.schedule = schedule
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.checkpointPath = checkpointPath
+        self.maxTurns = maxTurns
+        self.seed = seed
+        self.entropy = seed if seed is not None else np.random.SeedSequence().entropy
+        self.matches = []
+
+    def settings(self) -> dict:
+        """Header of the checkpoint, a checkpoint is only resumed by a tournament with the same settings"""
+        return {"type": "tournament", "players": self.names, "gamesPerMatch": self.gamesPerMatch, "rounds": self.rounds,
+                "schedule": self.schedule, "entropy": self.entropy, "maxTurns": self.maxTurns}
+
+    def _loadCheckpoint(self):
+        """Reads the finished matches of the checkpoint, or starts it"""
+        if self.checkpointPath is None:
+            return
+        if not os.path.exists(self.checkpointPath) or os.path.getsize(self.checkpointPath) == 0:
+            self._appendCheckpoint(self.settings())
+            return
+        with open(self.checkpointPath, encoding="utf-8") as file:
+            lines = file.read().split("\n")
+        header = json.loads(lines[0])
+        # Without a seed, the tournament resumes with the entropy of the checkpoint
+        if self.seed is None and header.get("type") == "tournament":
+            self.entropy = header["entropy"]
+        if header != self.settings():
+            raise ValueError(f"Checkpoint {self.checkpointPath} belongs to another tournament")
+        for line in lines[1:]:
+            try:
+                match = json.loads(line)
+            except json.JSONDecodeError:
+                # Line cut by the interruption of the run
+                continue
+            self.matches.append(match)
+        # Rewrite the checkpoint without the cut line
+        with open(self.checkpointPath, "w", encoding="utf-8") as file:
+            file.write("\n".join(json.dumps(line) for line in [header] + self.matches) + "\n")
+
+    def _appendCheckpoint(self, line: dict):
+        if self.checkpointPath is None:
+            return
+        with open(self.checkpointPath, "a", encoding="utf-8") as file:
+            file.write(json.dumps(line) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    def _pairings(self, round: int) -> list:
+        """Pairs of player names of the round"""
+        if self.schedule == "roundrobin":
+            return list(itertools.combinations(self.names, 2))
+        # Swiss, players sorted by points, then paired with the next player they haven't met
+        previous = [match for match in self.matches if match["round"] < round]
+        scores = dict.fromkeys(self.names, 0.0)
+        met = set()
+        for match in previous:
+            first, second = match["players"]
+            points = np.array(match["points"])
+            scores[first] += np.sum(points > 0) / len(points)
+            scores[second] += np.sum(points < 0) / len(points)
+            met.add(frozenset(match["players"]))
+        waiting = sorted(self.names, key=lambda name: (-scores[name], self.names.index(name)))
+        pairings = []
+        while len(waiting) >= 2:
+            first = waiting.pop(0)
+            # Rematches only if every remaining player was met
+            second = next((name for name in waiting if frozenset((first, name)) not in met), waiting[0])
+            waiting.remove(second)
+            pairings.append((first, second))
+        # The last player, if any, has a bye
+        return pairings
+
+    def _matchKey(self, round: int, first: str, second: str) -> tuple:
+        return (round, self.names.index(first), self.names.index(second))
+
+    def run(self) -> TournamentResult:
+        """Plays the matches not in the checkpoint yet, returns the results of all the matches"""
+        start = time.perf_counter()
+        self.matches = []
+        self._loadCheckpoint()
+        with processPool(self.workers) as executor:
+            # Round-robin pairings are known in advance, all the rounds are played at once
+            roundGroups = [list(range(self.rounds))] if self.schedule == "roundrobin" else [[round] for round in range(self.rounds)]
+            for roundGroup in roundGroups:
+                finished = {(match["round"], *match["players"]) for match in self.matches}
+                pending = [(round, first, second) for round in roundGroup for first, second in self._pairings(round)
+                           if (round, first, second) not in finished]
+                self._playMatches(pending, executor)
+        return TournamentResult(self.names, self.matches, time.perf_counter() - start)
+
+    def _playMatches(self, pending: list, executor):
+        """Plays the matches, checkpointing each one as soon as it is finished"""
+        def arguments(round: int, first: str, second: str) -> tuple:
+            return ((self.players[first], self.players[second]), self.gamesPerMatch, self.entropy,
+                    self._matchKey(round, first, second), self.maxTurns)
+
+        def finish(round: int, first: str, second: str, points: list):
+            match = {"round": round, "players": [first, second], "points": points}
+            self.matches.append(match)
+            self._appendCheckpoint(match)
+
+        if executor is None:
+            for match in pending:
+                finish(*match, _playMatch(*arguments(*match)))
+            return
+        from concurrent.futures import as_completed
+        futures = {executor.submit(_playMatch, *arguments(*match)): match for match in pending}
+        for future in as_completed(futures):
+            finish(*futures[future], future.result())
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Play a tournament between policies")
+    parser.add_argument("players", nargs="+", choices=policies, help="policies taking part")
+    parser.add_argument("--games", type=int, default=100, help="games per match")
+    parser.add_argument("--rounds", type=int, default=1, help="number of rounds")
+    parser.add_argument("--schedule", choices=schedules, default="roundrobin", help="pairing of the rounds")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the tournament")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes, all CPUs by default")
+    parser.add_argument("--checkpoint", default=None, help="JSON lines file to checkpoint to and resume from")
+    args = parser.parse_args()
+    tournament = Tournament({name: getPolicy(name) for name in args.players}, args.games, args.rounds, args.schedule,
+                            args.seed, args.workers, args.checkpoint)
+    print(tournament.run())
@@ -0,0 +1,212 @@
+import re
+
+import numpy as np
+
+from main import BackgammonBoard, BackgammonRules, blackPlayer
+
+# Transcript format
+# -----------------
+# One turn per line: the dice, a colon and the moves in the terminal game format, e.g. "3,1: 17,20;19,20".
+# The dice are optional for parsing but needed for validation, a turn without moves is written "6,6:".
+# Players alternate, starting with black. A blank line starts a new game from the initial positions.
+
+# Error codes of the turns
+OK = 0
+FORMAT = 1          # The line doesn't follow the format
+RANGE = 2           # A move is out of the board (0 to 25)
+DICE = 3            # A die is out of range (1 to 6)
+MISSING_DICE = 4    # The dice are needed to validate the turn
+ILLEGAL = 5         # The moves are not legal in the replayed positions
+
+errorNames = {OK: "ok", FORMAT: "format", RANGE: "range", DICE: "dice", MISSING_DICE: "missing dice", ILLEGAL: "illegal"}
+
+maxMoves = 4
+
+_linePattern = re.compile(r"\s*(?:\d,\d\s*:)?\s*(?:\d{1,2},\d{1,2}(?:\s*;\s*\d{1,2},\d{1,2}){0,3})?\s*")
+
+
+class Transcript():
+    """Turns of one or more games packed in arrays"""
+
+    def __init__(self, moves: np.ndarray, counts: np.ndarray, dice: np.ndarray, errors: np.ndarray,
+                 gameStarts: np.ndarray) -> None:
+        # Moves of every turn, array of shape (n,maxMoves,2) padded with -1
+        self.moves = moves
+        # Number of moves of every turn, array of shape (n,)
+        self.counts = counts
+        # Dice of every turn, array of shape (n,2), 0 if missing
+        self.dice = dice
+        # Error code of every turn, array of shape (n,)
+        self.errors = errors
+        # First turn of every game, array of shape (g,)
+        self.gameStarts = gameStarts
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def turn(self, turn: int) -> tuple[np.ndarray, np.ndarray]:
+        """The dice (array of shape (2,)) and moves (array of shape (m,2)) of the turn"""
+        return self.dice[turn], self.moves[turn, :self.counts[turn]]
+
+    def firstError(self) -> int:
+        """Index of the first turn with an error, -1 if none"""
+        errors = np.flatnonzero(self.errors)
+        return int(errors[0]) if len(errors) else -1
+
+
+def formatTurn(diceRolls, moves) -> str:
+    """Line of the transcript of a turn"""
+    return f"{int(diceRolls[0])},{int(diceRolls[1])}: " + ";".join(f"{int(moveFrom)},{int(moveTo)}" for moveFrom, moveTo in moves)
+
+
+def parseTranscript(lines) -> Transcript:
+    """Parses all the turns of a transcript at once
+
+    Every line is checked with a single regular expression, the numbers of all the lines are then
+    extracted together with numpy from the bytes of the whole transcript.
+
+    Parameters
+    ----------
+    lines : str or iterable of str
+        The transcript, or its lines (e.g. an open file)
+
+    Returns
+    -------
+    Transcript
+        The packed turns, lines with errors have no moves and their error code set
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    turnLines = []
+    gameStarts = [0]
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.strip():
+            turnLines.append(line)
+        elif len(turnLines) > gameStarts[-1]:
+            # Blank line, new game
+            gameStarts.append(len(turnLines))
+    nTurns = len(turnLines)
+    moves = np.full((nTurns, maxMoves, 2), -1, dtype=np.int8)
+    counts = np.zeros(nTurns, dtype=np.uint8)
+    dice = np.zeros((nTurns, 2), dtype=np.int8)
+    errors = np.zeros(nTurns, dtype=np.uint8)
+    gameStarts = np.array(gameStarts if nTurns else [], dtype=np.int64)
+    if nTurns == 0:
+        return Transcript(moves, counts, dice, errors, gameStarts)
+    # Format and dice of every line
+    valid = np.array([_linePattern.fullmatch(line) is not None for line in turnLines])
+    hasDice = np.array([":" in line for line in turnLines])
+    errors[~valid] = FORMAT
+    # Digits runs of the whole transcript
+    text = np.frombuffer("\n".join(turnLines).encode("ascii", errors="replace"), dtype=np.uint8)
+    isDigit = (text >= ord("0")) & (text <= ord("9"))
+    previous = np.concatenate(([False], isDigit[:-1]))
+    following = np.concatenate((isDigit[1:], [False]))
+    starts = np.flatnonzero(isDigit & ~previous)
+    ends = np.flatnonzero(isDigit & ~following) + 1
+    # Values of the numbers, the valid lines only have 1 or 2 digit numbers
+    lengths = ends - starts
+    values = (text[starts] - ord("0")).astype(np.int64)
+    long = lengths >= 2
+    values[long] = values[long] * 10 + text[starts[long] + 1] - ord("0")
+    # Line of every number and its rank within the line
+    lineEnds = np.flatnonzero(text == ord("\n"))
+    numberLines = np.searchsorted(lineEnds, starts)
+    numbersPerLine = np.bincount(numberLines, minlength=nTurns)
+    firstNumbers = np.concatenate(([0], np.cumsum(numbersPerLine)[:-1]))
+    ranks = np.arange(len(starts)) - firstNumbers[numberLines]
+    keep = valid[numberLines]
+    numberLines, ranks, values = numberLines[keep], ranks[keep], values[keep]
+    # Dice are the first 2 numbers of the lines with dice
+    diceNumbers = hasDice[numberLines] & (ranks < 2)
+    dice[numberLines[diceNumbers], ranks[diceNumbers]] = values[diceNumbers]
+    # Moves are the next ones
+    moveRanks = ranks - 2 * hasDice[numberLines]
+    moveNumbers = ~diceNumbers
+    moves.reshape(nTurns, 2 * maxMoves)[numberLines[moveNumbers], moveRanks[moveNumbers]] = values[moveNumbers]
+    counts[valid] = ((numbersPerLine - 2 * hasDice) // 2)[valid]
+    # Range checks
+    outOfRange = np.zeros(nTurns, dtype=bool)
+    np.logical_or.at(outOfRange, numberLines[moveNumbers], values[moveNumbers] > 25)
+    errors[valid & outOfRange] = RANGE
+    badDice = hasDice & np.any((dice < 1) | (dice > 6), axis=1)
+    errors[valid & ~outOfRange & badDice] = DICE
+    # Lines with errors have no moves
+    moves[errors != OK] = -1
+    counts[errors != OK] = 0
+    return Transcript(moves, counts, dice, errors, gameStarts)
+
+
+def validateTranscript(transcript: Transcript, rules: BackgammonRules = None) -> int:
+    """Replays every game of the transcript and checks that its turns are legal
+
+    Every game is replayed from the initial positions, black moving first, until its first turn with
+    an error, which gets an error code. Plays using all the dice in the order given are checked move by
+    move, the other ones with BackgammonRules.checkMoves.
+
+    Parameters
+    ----------
+    transcript : Transcript
+        Parsed transcript, its errors are updated
+    rules : BackgammonRules
+        Rules checking the turns
+
+    Returns
+    -------
+    int
+        Index of the first turn with an error, -1 if all the turns are legal
+    """
+    if rules is None:
+        rules = BackgammonRules()
+    gameEnds = np.append(transcript.gameStarts[1:], len(transcript))
+    initialPositions = BackgammonBoard(logging=False).initialPositions().tolist()
+    for gameStart, gameEnd in zip(transcript.gameStarts.tolist(), gameEnds.tolist()):
+        positions = list(initialPositions)
+        player = blackPlayer
+        for turn in range(gameStart, gameEnd):
+            if transcript.errors[turn] == OK and not transcript.dice[turn, 0]:
+                transcript.errors[turn] = MISSING_DICE
+            if transcript.errors[turn] != OK:
+                break
+            moves = transcript.moves[turn, :transcript.counts[turn]].tolist()
+            diceRolls = transcript.dice[turn].tolist()
+            if not _playAllDice(rules, positions, player, diceRolls, moves):
+                validMoves = rules.checkMoves(positions, np.array([moves], dtype=int).reshape(1, -1, 2), player, diceRolls)
+                if validMoves is None:
+                    transcript.errors[turn] = ILLEGAL
+                    break
+                for moveFrom, moveTo in validMoves.tolist():
+                    rules.makeMoveOnList(positions, player, moveFrom, moveTo)
+            # Turns after the end of the game
+            if not any(value * player > 0 for value in positions) and turn + 1 < gameEnd:
+                transcript.errors[turn + 1] = ILLEGAL
+                break
+            player = -player
+    return transcript.firstError()
+
+
+def _playAllDice(rules: BackgammonRules, positions: list, player: int, diceRolls: list, moves: list) -> bool:
+    """Plays the moves in place if they use all the dice in the given order, the fast path of validateTranscript
+
+    Returns False, leaving positions unchanged, if they don't. The play can still be legal in another order
+    or using fewer dice.
+    """
+    remaining = diceRolls * 2 if diceRolls[0] == diceRolls[1] else list(diceRolls)
+    if len(moves) != len(remaining):
+        return False
+    played = []
+    for moveFrom, moveTo in moves:
+        # Smallest die making the move valid
+        singleSteps = rules.legalSingleSteps(positions, player, sorted(set(remaining)))
+        for die in sorted(set(remaining)):
+            if (moveFrom, moveTo) in singleSteps[die]:
+                remaining.remove(die)
+                played.append((moveFrom, moveTo, rules.makeMoveOnList(positions, player, moveFrom, moveTo)))
+                break
+        else:
+            # Undo the moves played
+            for moveFrom, moveTo, hit in reversed(played):
+                rules.unmakeMoveOnList(positions, player, moveFrom, moveTo, hit)
+            return False
+    return True